@@ -0,0 +1,269 @@
+"""
+Columnar local store of loop metrics and features.
+
+Each run is a directory <store>/<run_id> with one .npy file per column, so
+columns are read with memory mapping and loops of many runs are loaded as
+NumPy arrays without queries to database:
+
+    run.json            run fields and features schema
+    functions.*.npy     id, application, filename and name of functions
+    loops.*.npy         id, loop_id, function (index in functions),
+                        exec_time, code_size and llc_misses of loops
+    features.*.npy      loop (index in loops), order, place, pass_name of
+                        features sets and values - matrix with
+                        FEATURES_SET_SCHEMA columns, missing values are NaN
+
+Store is optional and needs numpy.
+"""
+
+import array
+import json
+import os
+import shutil
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from runsystem.db.data import FEATURES_SET_SCHEMA
+
+FEATURE_NAMES = tuple(name for name, field in FEATURES_SET_SCHEMA)
+
+FUNCTION_COLUMNS = ('id', 'application', 'filename', 'name')
+LOOP_COLUMNS = ('id', 'loop_id', 'function', 'exec_time', 'code_size',
+                'llc_misses')
+FEATURES_COLUMNS = ('loop', 'order', 'place', 'pass_name', 'values')
+
+RUN_FILE = 'run.json'
+
+def available():
+    """Check if columnar store can be used."""
+    return numpy is not None
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("numpy is required for columnar store")
+
+def _strings(values):
+    """Fixed-width byte strings array, text is encoded to UTF-8."""
+    return numpy.array([value.encode('utf-8') if not isinstance(value, bytes)
+                        else value for value in values], dtype=bytes)
+
+def _features_dict(features_set):
+    """Values of features set, which may be wrapped in nested list."""
+    value = getattr(features_set, '_l_', features_set)
+    if isinstance(value, list):
+        value = value[0] if value else {}
+    if hasattr(value, 'to_dict'):
+        value = value.to_dict()
+    return value or {}
+
+def _feature_value(values, name):
+    value = values.get(name)
+    if value is None:
+        return float('nan')
+    return float(value)
+
+def features_values(features_set):
+    """Values of features set in FEATURE_NAMES order, missing values are
+    NaN."""
+    values = _features_dict(features_set)
+    return [_feature_value(values, name) for name in FEATURE_NAMES]
+
+class ColumnarWriter(object):
+    """Collect loops and features of run and write them as columns."""
+
+    def __init__(self, store_path, run_id, **run_fields):
+        _require_numpy()
+        self.store_path = store_path
+        self.run_id = run_id
+        self.run_fields = run_fields
+        self._functions = dict((column, []) for column in FUNCTION_COLUMNS)
+        self._function_rows = {}
+        self._loops = {'id': [], 'loop_id': [],
+                       'function': array.array('l'),
+                       'exec_time': array.array('d'),
+                       'code_size': array.array('d'),
+                       'llc_misses': array.array('d')}
+        self._loop_rows = {}
+        self._features = {'loop': array.array('l'),
+                          'order': array.array('l'),
+                          'place': [], 'pass_name': [],
+                          'values': array.array('d')}
+
+    def add_loop(self, loop, application, filename, function_name):
+        """Add loop document, it must already have id."""
+        function_key = (loop.function_id, application, filename, function_name)
+        if loop.function_id not in self._function_rows:
+            self._function_rows[loop.function_id] = len(self._functions['id'])
+            for column, value in zip(FUNCTION_COLUMNS, function_key):
+                self._functions[column].append(value)
+        self._loop_rows[loop.meta.id] = len(self._loops['id'])
+        self._loops['id'].append(loop.meta.id)
+        self._loops['loop_id'].append(loop.loop_id)
+        self._loops['function'].append(self._function_rows[loop.function_id])
+        for column in ('exec_time', 'code_size', 'llc_misses'):
+            value = getattr(loop, column)
+            self._loops[column].append(float('nan') if value is None else value)
+
+    def add_features(self, loop_id, order, features):
+        """Add features document for loop with given document id. Loop must
+        be added before its features."""
+        self._features['loop'].append(self._loop_rows[loop_id])
+        self._features['order'].append(order)
+        self._features['place'].append(features.place or '')
+        self._features['pass_name'].append(features.pass_name or '')
+        self._features['values'].extend(features_values(features.features_set))
+
+    def _columns(self):
+        yield 'functions.id', _strings(self._functions['id'])
+        yield 'functions.application', _strings(self._functions['application'])
+        yield 'functions.filename', _strings(self._functions['filename'])
+        yield 'functions.name', _strings(self._functions['name'])
+        yield 'loops.id', _strings(self._loops['id'])
+        yield 'loops.loop_id', _strings(self._loops['loop_id'])
+        yield 'loops.function', numpy.array(self._loops['function'],
+                                            dtype=numpy.int64)
+        for column in ('exec_time', 'code_size', 'llc_misses'):
+            yield 'loops.' + column, numpy.array(self._loops[column],
+                                                 dtype=numpy.float64)
+        yield 'features.loop', numpy.array(self._features['loop'],
+                                           dtype=numpy.int64)
+        yield 'features.order', numpy.array(self._features['order'],
+                                            dtype=numpy.int64)
+        yield 'features.place', _strings(self._features['place'])
+        yield 'features.pass_name', _strings(self._features['pass_name'])
+        values = numpy.array(self._features['values'], dtype=numpy.float64)
+        yield 'features.values', values.reshape(-1, len(FEATURE_NAMES))
+
+    def close(self):
+        """Write collected columns. Run directory is replaced atomically,
+        so readers never see partially written run."""
+        run_path = os.path.join(self.store_path, self.run_id)
+        tmp_path = run_path + '.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        for name, column in self._columns():
+            numpy.save(os.path.join(tmp_path, name + '.npy'), column)
+        run = dict(self.run_fields)
+        run['id'] = self.run_id
+        run['features'] = list(FEATURE_NAMES)
+        run['loops'] = len(self._loops['id'])
+        with open(os.path.join(tmp_path, RUN_FILE), 'w') as run_file:
+            json.dump(run, run_file, indent=2, sort_keys=True)
+        if os.path.exists(run_path):
+            shutil.rmtree(run_path)
+        os.rename(tmp_path, run_path)
+
+class ColumnarRun(object):
+    """Run read from columnar store. Columns are loaded on first access,
+    with memory mapping by default."""
+
+    def __init__(self, path, mmap=True):
+        _require_numpy()
+        self.path = path
+        self._mmap_mode = 'r' if mmap else None
+        self._columns = {}
+        with open(os.path.join(path, RUN_FILE)) as run_file:
+            self.run = json.load(run_file)
+        if tuple(self.run['features']) != FEATURE_NAMES:
+            raise ValueError("features schema of run %s doesn't match "
+                             "FEATURES_SET_SCHEMA" % self.run['id'])
+
+    @property
+    def id(self):
+        return self.run['id']
+
+    @property
+    def connected_run_id(self):
+        return self.run.get('connected_run_id')
+
+    def __len__(self):
+        return self.run['loops']
+
+    def column(self, table, name):
+        """Get column of table ('functions', 'loops' or 'features')."""
+        key = table + '.' + name
+        if key not in self._columns:
+            self._columns[key] = numpy.load(
+                os.path.join(self.path, key + '.npy'),
+                mmap_mode=self._mmap_mode)
+        return self._columns[key]
+
+    def loops(self, columns=LOOP_COLUMNS):
+        """Get {column: array} of loops."""
+        return dict((name, self.column('loops', name)) for name in columns)
+
+    def function_names(self):
+        """Array of function names of loops."""
+        return self.column('functions', 'name')[self.column('loops', 'function')]
+
+    def features(self, place='Before', pass_name=None):
+        """Matrix of features with row for each loop and FEATURE_NAMES
+        columns. Loop gets the first features set with given place (and
+        pass), loops without such features sets get NaN rows."""
+        matrix = numpy.full((len(self), len(FEATURE_NAMES)), numpy.nan)
+        loops = self.column('features', 'loop')
+        selected = numpy.ones(len(loops), dtype=bool)
+        if place is not None:
+            selected &= self.column('features', 'place') == place.encode('utf-8')
+        if pass_name is not None:
+            selected &= self.column('features', 'pass_name') == \
+                pass_name.encode('utf-8')
+        rows = numpy.flatnonzero(selected)
+        # The first set of each loop by order.
+        rows = rows[numpy.lexsort((self.column('features', 'order')[rows],
+                                   loops[rows]))]
+        loop_rows, first = numpy.unique(loops[rows], return_index=True)
+        matrix[loop_rows] = self.column('features', 'values')[rows[first]]
+        return matrix
+
+def list_runs(store_path):
+    """Get ids of runs in store."""
+    if not os.path.isdir(store_path):
+        return []
+    return sorted(name for name in os.listdir(store_path)
+                  if os.path.isfile(os.path.join(store_path, name, RUN_FILE)))
+
+def load_run(store_path, run_id, mmap=True):
+    """Get run from store."""
+    return ColumnarRun(os.path.join(store_path, run_id), mmap)
+
+def load_loops(store_path, run_ids=None, place='Before', pass_name=None):
+    """Load loops of several runs (all runs by default) as one table.
+    Returns {column: array} with LOOP_COLUMNS, 'function_name', 'run' (index
+    in 'run_ids' entry) and 'features' matrix."""
+    _require_numpy()
+    if run_ids is None:
+        run_ids = list_runs(store_path)
+    runs = [load_run(store_path, run_id) for run_id in run_ids]
+    parts = dict((name, []) for name in LOOP_COLUMNS +
+                 ('function_name', 'run', 'features'))
+    for index, run in enumerate(runs):
+        for name, column in run.loops().items():
+            parts[name].append(column)
+        parts['function_name'].append(run.function_names())
+        parts['run'].append(numpy.full(len(run), index, dtype=numpy.int64))
+        parts['features'].append(run.features(place, pass_name))
+    if not runs:
+        result = dict((name, numpy.array([])) for name in parts)
+        result['features'] = numpy.empty((0, len(FEATURE_NAMES)))
+    else:
+        result = dict((name, numpy.concatenate(columns))
+                      for name, columns in parts.items())
+    result['run_ids'] = list(run_ids)
+    return result
+
+def set_connected_run(store_path, run_id, connected_run_id):
+    """Save connected run of run which is already in store."""
+    path = os.path.join(store_path, run_id, RUN_FILE)
+    if not os.path.exists(path):
+        return
+    with open(path) as run_file:
+        run = json.load(run_file)
+    run['connected_run_id'] = connected_run_id
+    with open(path + '.tmp', 'w') as run_file:
+        json.dump(run, run_file, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
@@ -1,17 +1,25 @@
 import runsystem
 import json
+import itertools
+import uuid
+import hashlib
 
 from datetime import datetime
-from elasticsearch_dsl import DocType, Integer, Keyword, Text, Long
-from elasticsearch_dsl import InnerObjectWrapper, Nested, Boolean
-from elasticsearch_dsl import FacetedSearch, TermsFacet
+from elasticsearch import helpers
+from elasticsearch_dsl import DocType, Integer, Keyword, Text, Long, Float
+from elasticsearch_dsl import InnerObjectWrapper, Nested, Boolean, Object
+from elasticsearch_dsl import MultiSearch
 from elasticsearch_dsl.connections import connections
 
 class FeaturesFactory(object):
     """Class for creating features from llvm description."""
     @staticmethod
     def createFeatures(description, order = 0):
-        features_desc = json.loads(description)
+        """Create features from description, which is JSON string or
+        already parsed object."""
+        features_desc = description
+        if isinstance(description, basestring):
+            features_desc = json.loads(description)
         features_classes = {
             'loop' :'LoopFeatures'
         }
@@ -36,30 +44,37 @@ class FeaturesSet(InnerObjectWrapper):
             return getattr(self, feature_name)
         return None
 
+# Static features of loop with their types.
+FEATURES_SET_SCHEMA = (
+    ('numIVUsers', Integer),
+    ('isLoopSimplifyForm', Boolean),
+    ('isEmpty', Boolean),
+    ('numIntToFloatCast', Integer),
+    ('hasLoopPreheader', Boolean),
+    ('numTermBrBlocks', Integer),
+    ('latchBlockTermOpcode', Long),
+    ('numCalls', Integer),
+    ('notDuplicatable', Boolean),
+    ('convergent', Boolean),
+    ('loopSize', Integer),
+    ('tripCount', Integer),
+    ('tripMultiply', Long),
+    ('termByCondBr', Boolean),
+    ('headerAddressTaken', Boolean),
+    ('PHINodesInExitBlocks', Boolean)
+)
+
+def features_set_properties():
+    """Mapping properties for set of features."""
+    return dict((name, field()) for name, field in FEATURES_SET_SCHEMA)
+
 class Features(DocType):
     """ Database entity for static features."""
     pass_name = Keyword()
     place = Keyword()
     features_set = Nested(
         doc_class = FeaturesSet,
-        properties = {
-            'numIVUsers': Integer(),
-            'isLoopSimplifyForm': Boolean(),
-            'isEmpty': Boolean(),
-            'numIntToFloatCast': Integer(),
-            'hasLoopPreheader': Boolean(),
-            'numTermBrBlocks': Integer(),
-            'latchBlockTermOpcode': Long(),
-            'numCalls': Integer(),
-            'notDuplicatable': Boolean(),
-            'convergent': Boolean(),
-            'loopSize': Integer(),
-            'tripCount': Integer(),
-            'tripMultiply': Long(),
-            'termByCondBr': Boolean(),
-            'headerAddressTaken': Boolean(),
-            'PHINodesInExitBlocks': Boolean()
-        }
+        properties = features_set_properties()
     )
 
     class Meta:
@@ -93,28 +108,80 @@ class Function(DocType):
     def save(self, ** kwargs):
         return super(Function, self).save(** kwargs)
 
+    @staticmethod
+    def make_id(run_id, application, filename, function_name):
+        """Deterministic document id for function of run."""
+        key = u'\0'.join((run_id, application, filename, function_name))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
     @staticmethod
     def get_ot_create_function(application, run_id, filename, function_name):
-        search = Function.search().query('match', run_id=run_id).\
-                                   query('match', application=application).\
-                                   query('match', filename=filename).\
-                                   query('match', function_name=function_name)
-
-        response = search.execute()
-        if response.success() and len(response):
-            return response[0]
-        function = Function(application = application,
+        function_id = Function.make_id(run_id, application, filename, function_name)
+        function = Function.get(id=function_id, ignore=404)
+        if function:
+            return function
+        function = Function(meta={'id': function_id},
+                            application = application,
                             run_id = run_id, 
                             filename = filename, 
                             function_name = function_name)
         function.save()
         return function
 
+class FunctionCache(object):
+    """In-memory cache of functions of run.
+
+    Functions get deterministic ids, so creating function doesn't need to
+    read database and saving the same function twice doesn't create
+    duplicates."""
+
+    def __init__(self, run_id, writer=None, load_existing=True):
+        self.run_id = run_id
+        self._writer = writer
+        self._functions = {}
+        if not load_existing:
+            # New run, database isn't needed.
+            return
+        # Load functions which are already saved for run.
+        s = Function.search().query('match', run_id=run_id)
+        for function in s.scan():
+            key = (run_id, function.application, function.filename,
+                   function.function_name)
+            self._functions[key] = function.meta.id
+
+    def get_function_id(self, application, filename, function_name):
+        """Get id of function, function is created if it isn't known yet."""
+        key = (self.run_id, application, filename, function_name)
+        if key not in self._functions:
+            function = Function(meta={'id': Function.make_id(*key)},
+                                application = application,
+                                run_id = self.run_id,
+                                filename = filename,
+                                function_name = function_name)
+            if self._writer:
+                self._writer.add(function)
+            else:
+                function.save()
+            self._functions[key] = function.meta.id
+        return self._functions[key]
+
 class Run(DocType):
     """Database entity for run of system."""
     options = Text()
     date_time = Text()
     connected_run_id = Keyword()
+    # Time when results of run were saved, it changes when run is ingested
+    # again.
+    ingest_time = Keyword()
+    # Set while loops of run are being saved, runs saved before it was
+    # added don't have it.
+    ingesting = Boolean()
+    # State of machine during measurements.
+    profile_cpus = Keyword()
+    cpu_governors = Keyword()
+    load_average = Float()
+    noise = Keyword()
+    noisy = Boolean()
 
     class Meta:
         index = 'runsystemdb'
@@ -122,13 +189,33 @@ class Run(DocType):
     def save(self, ** kwargs):
         return super(Run, self).save(** kwargs)
 
+# Statistics of repeated measurements of loop.
+LOOP_STATISTICS = ('repetitions',
+                   'exec_time_mean', 'exec_time_median',
+                   'exec_time_min', 'exec_time_stddev',
+                   'llc_misses_mean', 'llc_misses_median',
+                   'llc_misses_min', 'llc_misses_stddev')
+
+# Measured metrics of loop.
+LOOP_METRICS = ('exec_time', 'code_size', 'llc_misses')
+
 class Loop(DocType):
-    """Database entity for loop."""
+    """Database entity for loop. If loop is measured several times,
+    exec_time and llc_misses are rounded medians."""
     loop_id = Keyword()
     exec_time = Long()
     code_size = Long()
     llc_misses = Long()
     function_id = Keyword()
+    repetitions = Long()
+    exec_time_mean = Float()
+    exec_time_median = Float()
+    exec_time_min = Float()
+    exec_time_stddev = Float()
+    llc_misses_mean = Float()
+    llc_misses_median = Float()
+    llc_misses_min = Float()
+    llc_misses_stddev = Float()
 
     class Meta:
         index = 'runsystemdb'
@@ -136,49 +223,391 @@ class Loop(DocType):
     def save(self, ** kwargs):
         return super(Loop, self).save(** kwargs)
 
-class ApplicationSearch(FacetedSearch):
-    index = 'runsystemdb'
-    doc_types = [Function, ]
-    fields = ['application', 'filename', 'function_name']
+class RunLoop(DocType):
+    """Denormalized database entity for loop with its function, run and
+    features. It has the same id as Loop, so it's optional and pages fall
+    back to Loop if it doesn't exist."""
+    loop_id = Keyword()
+    exec_time = Long()
+    code_size = Long()
+    llc_misses = Long()
+    function_id = Keyword()
+    repetitions = Long()
+    exec_time_mean = Float()
+    exec_time_median = Float()
+    exec_time_min = Float()
+    exec_time_stddev = Float()
+    llc_misses_mean = Float()
+    llc_misses_median = Float()
+    llc_misses_min = Float()
+    llc_misses_stddev = Float()
+    function_name = Keyword(store=True)
+    application = Keyword()
+    filename = Keyword()
+    run_id = Keyword()
+    run_options = Text()
+    features = Nested(
+        properties = {
+            'features_id': Keyword(),
+            'order': Long(),
+            'pass_name': Keyword(),
+            'place': Keyword(),
+            'features_set': Object(doc_class = FeaturesSet,
+                                   properties = features_set_properties())
+        }
+    )
 
-    facets = {
-        'tags': TermsFacet(field='application')
-    }
+    class Meta:
+        index = 'runsystemdb'
 
-    def __init__(self, run_id):
-        self.run_id = run_id
-        super(ApplicationSearch, self).__init__()
-        
+    def save(self, ** kwargs):
+        return super(RunLoop, self).save(** kwargs)
+
+    @staticmethod
+    def from_loop(loop, run_id, run_options, application, filename,
+                  function_name, features):
+        """Create denormalized loop. Features is list of
+        (order, Features) pairs."""
+        run_loop = RunLoop(meta={'id': loop.meta.id},
+                           loop_id = loop.loop_id,
+                           exec_time = loop.exec_time,
+                           code_size = loop.code_size,
+                           llc_misses = loop.llc_misses,
+                           function_id = loop.function_id,
+                           function_name = function_name,
+                           application = application,
+                           filename = filename,
+                           run_id = run_id,
+                           run_options = run_options)
+        for field in LOOP_STATISTICS:
+            setattr(run_loop, field, getattr(loop, field))
+        run_loop.features = [{'features_id': features_set.meta.id,
+                              'order': order,
+                              'pass_name': features_set.pass_name,
+                              'place': features_set.place,
+                              'features_set': _to_dict(features_set.features_set)}
+                             for order, features_set in sorted(features,
+                                                               key=lambda item: item[0])]
+        return run_loop
+
+    def get_function(self):
+        """Function of loop built from embedded fields."""
+        return Function(meta={'id': self.function_id},
+                        application = self.application,
+                        filename = self.filename,
+                        function_name = self.function_name,
+                        run_id = self.run_id)
+
+    def get_features_sets(self):
+        """Pairs of (Before, After) features built from embedded fields."""
+        features = [Features(meta={'id': features.features_id},
+                             pass_name = features.pass_name,
+                             place = features.place,
+                             features_set = _to_dict(features.features_set))
+                    for features in sorted(self.features or [],
+                                           key=lambda features: features.order)]
+        return pair_features_sets(features)
+
+class LoopDelta(DocType):
+    """Database entity for loop of run matched with the same loop (by
+    application, filename, function name and loop id) of compared run.
+    Deltas are run values minus compared run values, speedup is compared
+    exec_time divided by exec_time. It's computed once for pair of runs, so
+    comparisons don't need to match loops again."""
+    run_id = Keyword()
+    compared_run_id = Keyword()
+    loop_id = Keyword()
+    block_id = Keyword()
+    compared_block_id = Keyword()
+    function_id = Keyword()
+    function_name = Keyword(store=True)
+    application = Keyword()
+    filename = Keyword()
+    exec_time = Long()
+    code_size = Long()
+    llc_misses = Long()
+    compared_exec_time = Long()
+    compared_code_size = Long()
+    compared_llc_misses = Long()
+    exec_time_delta = Long()
+    code_size_delta = Long()
+    llc_misses_delta = Long()
+    speedup = Float()
+
+    class Meta:
+        index = 'runsystemdb'
+
+    def save(self, ** kwargs):
+        return super(LoopDelta, self).save(** kwargs)
+
+    @staticmethod
+    def make_id(run_id, compared_run_id, block_id):
+        """Deterministic document id, so deltas can be computed again."""
+        key = u'\0'.join((run_id, compared_run_id, block_id))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def from_loops(run_id, compared_run_id, function, loop, compared_loop):
+        """Create delta of loop of function and compared loop, which is
+        (id, exec_time, code_size, llc_misses) tuple."""
+        compared_block_id = compared_loop[0]
+        delta = LoopDelta(meta={'id': LoopDelta.make_id(run_id, compared_run_id,
+                                                        loop.meta.id)},
+                          run_id = run_id,
+                          compared_run_id = compared_run_id,
+                          loop_id = loop.loop_id,
+                          block_id = loop.meta.id,
+                          compared_block_id = compared_block_id,
+                          function_id = function.meta.id,
+                          function_name = function.function_name,
+                          application = function.application,
+                          filename = function.filename)
+        for metric, compared_value in zip(LOOP_METRICS, compared_loop[1:]):
+            value = getattr(loop, metric)
+            setattr(delta, metric, value)
+            setattr(delta, 'compared_' + metric, compared_value)
+            if value is not None and compared_value is not None:
+                setattr(delta, metric + '_delta', value - compared_value)
+        if delta.exec_time and delta.compared_exec_time is not None:
+            delta.speedup = float(delta.compared_exec_time) / delta.exec_time
+        return delta
 
-    def search(self):
-        s = super(ApplicationSearch, self).search()
-        return s.query("match", run_id=self.run_id)
+    def get_compared_loop(self):
+        """Compared loop built from embedded fields."""
+        return Loop(meta={'id': self.compared_block_id},
+                    loop_id = self.loop_id,
+                    exec_time = self.compared_exec_time,
+                    code_size = self.compared_code_size,
+                    llc_misses = self.compared_llc_misses)
 
-class FilenameSearch(FacetedSearch):
-    index = 'runsystemdb'
-    doc_types = [Function, ]
-    fields = ['application', 'filename', 'function_name']
+def _to_dict(value):
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    return value
 
-    facets = {
-        'tags': TermsFacet(field='filename')
-    }
+def pair_features_sets(features):
+    """Split ordered list of features into pairs of features collected
+    before and after pass. If the same place is repeated, only the last
+    features set is used."""
+    features_sets = {}
+    features_sets['Before'] = []
+    features_sets['After'] = []
+    previous_place = 'After'
+    for features_set in features:
+        if features_set.place == previous_place:
+            del features_sets[features_set.place][-1]
+        features_sets[features_set.place].append(features_set)
+        previous_place = features_set.place
+    return zip(features_sets['Before'], features_sets['After'])
 
-    def __init__(self, application):
-        self.application = application
-        super(FilenameSearch, self).__init__()
-        
+def get_features(features_ids):
+    """Get Features documents with one request.
+    Returns {features_id: Features}, missing documents are skipped."""
+    result = {}
+    if features_ids:
+        for features_set in Features.mget(list(features_ids), missing='none'):
+            if features_set:
+                result[features_set.meta.id] = features_set
+    return result
 
-    def search(self):
-        s = super(FilenameSearch, self).search()
-        return s.query("match", application=self.application)
+def get_loops_features_sets(loop_features):
+    """Resolve features of LoopFeatures entities of several loops with one
+    request. Returns {block_id: [(Before, After), ...]}."""
+    loop_features = sorted(loop_features, key=lambda item: item.order)
+    features_docs = get_features(set(item.features_id for item in loop_features))
+    features = {}
+    for item in loop_features:
+        if item.features_id in features_docs:
+            features.setdefault(item.block_id, []).append(
+                features_docs[item.features_id])
+    return dict((block_id, pair_features_sets(block_features))
+                for block_id, block_features in features.iteritems())
 
+def get_features_sets(loop_features):
+    """Resolve features of LoopFeatures entities of one loop with one
+    request. Returns [(Before, After), ...]."""
+    features_sets = get_loops_features_sets(loop_features)
+    if not features_sets:
+        return []
+    return features_sets.values()[0]
 
-def init_database():
-    # Define a default Elasticsearch client
-    connections.create_connection(hosts=['localhost'])
+# Maximum number of applications in run and files in application.
+MAX_APPLICATIONS = 10000
+MAX_FILENAMES = 10000
+
+def get_applications(run_ids):
+    """Get applications of runs with their files with one request.
+    Returns list of {application: [filename, ...]} in order of run_ids."""
+    ms = MultiSearch(index='runsystemdb')
+    for run_id in run_ids:
+        s = Function.search().query('match', run_id=run_id).extra(size=0)
+        s.aggs.bucket('applications', 'terms', field='application',
+                      size=MAX_APPLICATIONS).\
+               bucket('filenames', 'terms', field='filename',
+                      size=MAX_FILENAMES)
+        ms = ms.add(s)
+    result = []
+    for response in ms.execute():
+        applications = {}
+        for application in response.aggregations.applications.buckets:
+            applications[application.key] = [filename.key for filename in
+                                              application.filenames.buckets]
+        result.append(applications)
+    return result
+
+class BulkWriter(object):
+    """Buffered writer which saves documents with bulk requests.
+
+    Documents get client-generated ids when they are added, so they can be
+    referenced by other documents before they are written to database.
+    If ingest queue is given, batches are written by its background
+    writer."""
+
+    def __init__(self, batch_size=500, max_bytes=100 * 1024 * 1024,
+                 queue=None):
+        # Maximum number of documents and size in bytes of one bulk request.
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.queue = queue
+        self._actions = []
+
+    def add(self, document):
+        """Add document to buffer and return its id."""
+        if 'id' not in document.meta:
+            document.meta.id = uuid.uuid4().hex
+        self._actions.append(document.to_dict(include_meta=True))
+        if len(self._actions) >= self.batch_size:
+            self.flush()
+        return document.meta.id
+
+    def flush(self, refresh=False):
+        """Write all buffered documents. With refresh, method waits until
+        they are written and searchable."""
+        if self.queue:
+            if self._actions:
+                self.queue.put(self._actions, chunk_size=self.batch_size,
+                               max_bytes=self.max_bytes)
+                self._actions = []
+            if refresh:
+                self.queue.refresh()
+            return
+        connection = connections.get_connection()
+        if self._actions:
+            helpers.bulk(connection, self._actions,
+                         chunk_size=self.batch_size,
+                         max_chunk_bytes=self.max_bytes)
+            self._actions = []
+        if refresh:
+            connection.indices.refresh(index='runsystemdb')
+
+def batches(iterable, size):
+    """Split iterable into lists with given size."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def backfill_run_loops(writer, run_id=None):
+    """Create denormalized loops for already saved runs."""
+    s = Run.search()
+    if run_id:
+        s = s.query('ids', values=[run_id])
+    for run in s.scan():
+        functions_search = Function.search().query('match', run_id=run.meta.id)
+        for functions in batches(functions_search.scan(), 500):
+            functions = dict((function.meta.id, function) for function in functions)
+            loops_search = Loop.search().filter('terms', function_id=functions.keys())
+            for loops in batches(loops_search.scan(), 500):
+                loops_features = LoopFeatures.search().\
+                    filter('terms', block_id=[loop.meta.id for loop in loops]).scan()
+                loops_features = list(loops_features)
+                features_docs = get_features(set(loop_features.features_id
+                                                 for loop_features in loops_features))
+                features = {}
+                for loop_features in loops_features:
+                    if loop_features.features_id in features_docs:
+                        features.setdefault(loop_features.block_id, []).append(
+                            (loop_features.order,
+                             features_docs[loop_features.features_id]))
+                for loop in loops:
+                    function = functions[loop.function_id]
+                    writer.add(RunLoop.from_loop(loop, run.meta.id, run.options,
+                                                 function.application,
+                                                 function.filename,
+                                                 function.function_name,
+                                                 features.get(loop.meta.id, [])))
+    writer.flush(refresh=True)
+
+def iter_run_loops(run_id, batch_size=500):
+    """Iterate over (function, loop) pairs of run."""
+    functions_search = Function.search().query('match', run_id=run_id)
+    for functions in batches(functions_search.scan(), batch_size):
+        functions = dict((function.meta.id, function) for function in functions)
+        loops_search = Loop.search().filter('terms', function_id=functions.keys())
+        for loop in loops_search.scan():
+            yield functions[loop.function_id], loop
+
+def _loop_key(function, loop):
+    return (function.application, function.filename, function.function_name,
+            loop.loop_id)
+
+def compute_loop_deltas(writer, run_id, compared_run_id, batch_size=500):
+    """Match loops of run with loops of compared run and save LoopDelta
+    for each matched loop. Returns number of matched loops."""
+    compared_loops = {}
+    for function, loop in iter_run_loops(compared_run_id, batch_size):
+        compared_loops[_loop_key(function, loop)] = \
+            (loop.meta.id,) + tuple(getattr(loop, metric)
+                                    for metric in LOOP_METRICS)
+    matched = 0
+    for function, loop in iter_run_loops(run_id, batch_size):
+        compared_loop = compared_loops.get(_loop_key(function, loop))
+        if compared_loop is None:
+            continue
+        writer.add(LoopDelta.from_loops(run_id, compared_run_id, function,
+                                        loop, compared_loop))
+        matched += 1
+    writer.flush(refresh=True)
+    return matched
+
+def compute_connected_loop_deltas(writer, run_id=None, batch_size=500):
+    """Compute loop deltas of runs (or given run) with their connected
+    runs."""
+    s = Run.search().filter('exists', field='connected_run_id')
+    if run_id:
+        s = s.query('ids', values=[run_id])
+    for run in s.scan():
+        compute_loop_deltas(writer, run.meta.id, run.connected_run_id,
+                            batch_size)
+
+DEFAULT_HOSTS = ['localhost']
+
+# Mappings are created once per process.
+_database_initialized = False
+
+def configure_database(hosts=None):
+    """Configure default Elasticsearch client. Connection is opened lazily,
+    when it is used for the first time."""
+    try:
+        connections.remove_connection('default')
+    except KeyError:
+        pass
+    connections.configure(default={'hosts': hosts or DEFAULT_HOSTS})
+
+def init_database(force=False):
+    global _database_initialized
+    if _database_initialized and not force:
+        return
     # Create the mappings in Elasticsearch
     Run.init()
     Function.init()
     Features.init()
     Loop.init()
     LoopFeatures.init()
+    RunLoop.init()
+    LoopDelta.init()
+    _database_initialized = True
+
+configure_database()
@@ -0,0 +1,298 @@
+"""
+Export of loops of connected runs as dataset for ML training.
+
+Each row is a loop of run which is matched by application, filename,
+function name and loop id with loop of its connected run. Row has
+features of loop in the run (FEATURE_NAMES columns) and targets - changes
+of exec_time, code_size and llc_misses against the connected run.
+
+Loops are read from database with batched scans or from columnar store,
+rows are assembled with NumPy.
+"""
+
+import array
+import csv
+import math
+
+from runsystem.db import columnar
+from runsystem.db import data
+from runsystem.db.columnar import FEATURE_NAMES
+
+# Columns with loop identity and metrics, in output order.
+KEY_COLUMNS = ('application', 'filename', 'function_name', 'loop_id')
+METRICS = ('exec_time', 'code_size', 'llc_misses')
+TARGET_COLUMNS = tuple(metric + '_delta' for metric in METRICS)
+
+def _require_numpy():
+    if not columnar.available():
+        raise ImportError("numpy is required for dataset export")
+
+def _table(keys, metrics, features):
+    numpy = columnar.numpy
+    table = {'keys': keys,
+             'features': numpy.array(features, dtype=numpy.float64).reshape(
+                 -1, len(FEATURE_NAMES))}
+    for metric in METRICS:
+        table[metric] = numpy.array(metrics[metric], dtype=numpy.float64)
+    return table
+
+def _first_features(loop_features, features_docs, place, pass_name):
+    """Get features document of the first features set of loop with given
+    place and pass."""
+    for item in sorted(loop_features, key=lambda item: item.order):
+        features = features_docs.get(item.features_id)
+        if features is None:
+            continue
+        if place is not None and features.place != place:
+            continue
+        if pass_name is not None and features.pass_name != pass_name:
+            continue
+        return features
+    return None
+
+def _get_features_values(block_ids, place, pass_name):
+    """Get {block_id: features values} for loops with given document ids,
+    loops without features sets are missing."""
+    loops_features = {}
+    for loop_features in data.LoopFeatures.search().filter(
+            'terms', block_id=block_ids).scan():
+        loops_features.setdefault(loop_features.block_id,
+                                  []).append(loop_features)
+    features_docs = data.get_features(set(
+        item.features_id for items in loops_features.values()
+        for item in items))
+    result = {}
+    for block_id, items in loops_features.items():
+        features = _first_features(items, features_docs, place, pass_name)
+        if features is not None:
+            result[block_id] = columnar.features_values(features.features_set)
+    return result
+
+def _metric_value(value):
+    return float('nan') if value is None else value
+
+def load_database_table(run_id, place='Before', pass_name=None,
+                        batch_size=500):
+    """Load loops of run from database. Returns table {'keys': [key, ...],
+    metric: array, 'features': matrix}."""
+    keys = []
+    metrics = dict((metric, array.array('d')) for metric in METRICS)
+    features = array.array('d')
+    missing = [float('nan')] * len(FEATURE_NAMES)
+    for loops in data.batches(data.iter_run_loops(run_id, batch_size),
+                              batch_size):
+        features_values = _get_features_values(
+            [loop.meta.id for function, loop in loops], place, pass_name)
+        for function, loop in loops:
+            keys.append((function.application, function.filename,
+                         function.function_name, loop.loop_id))
+            for metric in METRICS:
+                metrics[metric].append(_metric_value(getattr(loop, metric)))
+            features.extend(features_values.get(loop.meta.id, missing))
+    return _table(keys, metrics, features)
+
+def load_database_deltas(run_id, compared_run_id, place='Before',
+                         pass_name=None, batch_size=500):
+    """Load pair of runs from stored loop deltas, result is the same as
+    result of pair_tables(). Returns None if deltas aren't computed for
+    runs."""
+    numpy = columnar.numpy
+    columns = dict((name, []) for name in KEY_COLUMNS)
+    for metric in METRICS:
+        for name in (metric, 'connected_' + metric):
+            columns[name] = array.array('d')
+    features = array.array('d')
+    missing = [float('nan')] * len(FEATURE_NAMES)
+    s = data.LoopDelta.search().filter('term', run_id=run_id).\
+        filter('term', compared_run_id=compared_run_id)
+    for deltas in data.batches(s.scan(), batch_size):
+        features_values = _get_features_values(
+            [delta.block_id for delta in deltas], place, pass_name)
+        for delta in deltas:
+            for name in KEY_COLUMNS:
+                columns[name].append(getattr(delta, name))
+            for metric in METRICS:
+                columns[metric].append(_metric_value(getattr(delta, metric)))
+                columns['connected_' + metric].append(
+                    _metric_value(getattr(delta, 'compared_' + metric)))
+            features.extend(features_values.get(delta.block_id, missing))
+    if not columns['loop_id']:
+        return None
+    result = {'features': numpy.array(features, dtype=numpy.float64).reshape(
+        -1, len(FEATURE_NAMES))}
+    for name in KEY_COLUMNS:
+        result[name] = numpy.array(columns[name], dtype=object)
+    for metric in METRICS:
+        for name in (metric, 'connected_' + metric):
+            result[name] = numpy.array(columns[name], dtype=numpy.float64)
+        result[metric + '_delta'] = result[metric] - \
+            result['connected_' + metric]
+    return result
+
+def load_store_table(run, place='Before', pass_name=None):
+    """Load loops of run from columnar store, run is ColumnarRun."""
+    functions = run.column('loops', 'function')
+    columns = [run.column('functions', name)[functions]
+               for name in ('application', 'filename', 'name')]
+    columns.append(run.column('loops', 'loop_id'))
+    keys = [tuple(value.decode('utf-8') for value in key)
+            for key in zip(*columns)]
+    table = {'keys': keys, 'features': run.features(place, pass_name)}
+    for metric in METRICS:
+        table[metric] = run.column('loops', metric)
+    return table
+
+def pair_tables(table, connected):
+    """Match loops of run with loops of connected run. Returns {column:
+    array} with KEY_COLUMNS, metrics of both runs, TARGET_COLUMNS and
+    'features' matrix."""
+    numpy = columnar.numpy
+    connected_rows = dict((key, row) for row, key in enumerate(connected['keys']))
+    rows = array.array('l')
+    other_rows = array.array('l')
+    for row, key in enumerate(table['keys']):
+        other_row = connected_rows.get(key)
+        if other_row is not None:
+            rows.append(row)
+            other_rows.append(other_row)
+    rows = numpy.array(rows, dtype=numpy.int64)
+    other_rows = numpy.array(other_rows, dtype=numpy.int64)
+    result = {'features': table['features'][rows]}
+    keys = [table['keys'][row] for row in rows]
+    for index, column in enumerate(KEY_COLUMNS):
+        result[column] = numpy.array([key[index] for key in keys],
+                                     dtype=object)
+    for metric in METRICS:
+        values = numpy.asarray(table[metric])[rows]
+        connected_values = numpy.asarray(connected[metric])[other_rows]
+        result[metric] = values
+        result['connected_' + metric] = connected_values
+        result[metric + '_delta'] = values - connected_values
+    return result
+
+def is_baseline(run, connected_run):
+    """Baseline and run with ML options may be connected to each other,
+    baseline options are the first part of options of the other run."""
+    if connected_run.get('connected_run_id') != run['id']:
+        return False
+    options = run.get('options') or ''
+    connected_options = connected_run.get('options') or ''
+    return len(options) < len(connected_options) and \
+        connected_options.startswith(options)
+
+def _database_runs(run_ids):
+    if run_ids:
+        runs = [run for run in data.Run.mget(run_ids, missing='none') if run]
+    else:
+        runs = data.Run.search().filter('exists', field='connected_run_id').scan()
+    return [dict(run.to_dict(), id=run.meta.id) for run in runs]
+
+def _get_database_run(run_id):
+    run = data.Run.get(id=run_id, ignore=404)
+    if run is None:
+        return None
+    return dict(run.to_dict(), id=run.meta.id)
+
+def build_dataset(run_ids=None, store_path=None, place='Before',
+                  pass_name=None, batch_size=500):
+    """Build dataset from given runs (all connected runs by default).
+    Runs are read from columnar store if store_path is given, otherwise
+    from database, where loop deltas are used if they are computed for
+    pair of runs. Baselines connected back to their only run are skipped,
+    so each pair of runs is exported once.
+    Returns {column: array} (see pair_tables) with 'run_id' and
+    'connected_run_id' columns."""
+    _require_numpy()
+    numpy = columnar.numpy
+    if store_path:
+        stored_ids = columnar.list_runs(store_path)
+        store_runs = dict((run_id, columnar.load_run(store_path, run_id))
+                          for run_id in stored_ids)
+        def get_run(run_id):
+            run = store_runs.get(run_id)
+            return run.run if run is not None else None
+        def load_table(run_id):
+            return load_store_table(store_runs[run_id], place, pass_name)
+        def load_pair(run_id, connected_run_id):
+            return None
+        runs = [get_run(run_id) for run_id in (run_ids or stored_ids)]
+    else:
+        get_run = _get_database_run
+        def load_table(run_id):
+            return load_database_table(run_id, place, pass_name, batch_size)
+        def load_pair(run_id, connected_run_id):
+            return load_database_deltas(run_id, connected_run_id, place,
+                                        pass_name, batch_size)
+        runs = _database_runs(run_ids)
+
+    # Tables are cached, so baseline compared with several runs is loaded
+    # once.
+    tables = {}
+    def get_table(run_id):
+        if run_id not in tables:
+            tables[run_id] = load_table(run_id)
+        return tables[run_id]
+
+    parts = []
+    for run in runs:
+        if not run or not run.get('connected_run_id'):
+            continue
+        connected_run = get_run(run['connected_run_id'])
+        if not connected_run or is_baseline(run, connected_run):
+            continue
+        # Stored loop deltas are used if they are computed.
+        pair = load_pair(run['id'], connected_run['id'])
+        if pair is None:
+            pair = pair_tables(get_table(run['id']),
+                               get_table(connected_run['id']))
+        rows = len(pair['features'])
+        pair['run_id'] = numpy.array([run['id']] * rows, dtype=object)
+        pair['connected_run_id'] = numpy.array([connected_run['id']] * rows,
+                                               dtype=object)
+        parts.append(pair)
+    if not parts:
+        return None
+    return dict((name, numpy.concatenate([part[name] for part in parts]))
+                for name in parts[0])
+
+def _output_columns():
+    return (('run_id', 'connected_run_id') + KEY_COLUMNS + METRICS +
+            tuple('connected_' + metric for metric in METRICS) +
+            TARGET_COLUMNS)
+
+def write_npz(path, dataset):
+    """Write dataset to NumPy .npz file. Strings are saved as unicode
+    arrays, features matrix has 'feature_names' columns."""
+    numpy = columnar.numpy
+    arrays = {}
+    for name in _output_columns():
+        column = dataset[name]
+        if column.dtype == object:
+            column = numpy.array(column.tolist(), dtype=unicode)
+        arrays[name] = column
+    arrays['features'] = dataset['features']
+    arrays['feature_names'] = numpy.array(FEATURE_NAMES)
+    numpy.savez_compressed(path, **arrays)
+
+def _csv_value(value):
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ''
+        if value == int(value):
+            return int(value)
+    if not isinstance(value, str) and hasattr(value, 'encode'):
+        return value.encode('utf-8')
+    return value
+
+def write_csv(path, dataset):
+    """Write dataset to CSV file with features columns after other
+    columns, missing values are empty."""
+    columns = _output_columns()
+    with open(path, 'wb') as output:
+        writer = csv.writer(output)
+        writer.writerow(columns + FEATURE_NAMES)
+        values = [dataset[name].tolist() for name in columns]
+        features = dataset['features'].tolist()
+        for row, features_row in zip(zip(*values), features):
+            writer.writerow([_csv_value(value)
+                             for value in row + tuple(features_row)])
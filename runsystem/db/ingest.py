@@ -0,0 +1,157 @@
+"""
+Background ingest of documents to database.
+
+Bulk batches are put into bounded queue and written by background thread,
+so producers wait for database only if queue is full. If database fails
+or doesn't accept batch in time, batches are appended to local journal
+file (one JSON bulk action per line). Once journal is used, all following
+batches of the session go to journal too, so documents are never written
+out of order. Journal is loaded to database later with
+replay_journal().
+"""
+
+import datetime
+import json
+import os
+import Queue
+import threading
+
+from elasticsearch import helpers
+from elasticsearch_dsl.connections import connections
+
+INDEX_NAME = 'runsystemdb'
+
+class IngestQueue(object):
+    """Bounded queue of bulk batches drained by background writer."""
+
+    def __init__(self, journal_path=None, max_batches=8, put_timeout=600):
+        self.journal_path = journal_path
+        # Seconds to wait for free place in queue before batch is spooled
+        # to journal, None means waiting forever.
+        self.put_timeout = put_timeout
+        self.written = 0
+        self.spooled = 0
+        self._queue = Queue.Queue(max_batches)
+        self._spooling = False
+        self._error = None
+        self._thread = threading.Thread(target=self._drain,
+                                        name='runsystem-ingest')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, actions, chunk_size=500, max_bytes=100 * 1024 * 1024):
+        """Queue bulk actions for writing."""
+        self._check_error()
+        batch = (actions, chunk_size, max_bytes)
+        # Batches are always written by background writer, so they keep
+        # their order in database and journal.
+        if not self._spooling and self.journal_path:
+            try:
+                self._queue.put(batch, timeout=self.put_timeout)
+                return
+            except Queue.Full:
+                # Database is too slow, don't stall producer.
+                self._spooling = True
+        self._queue.put(batch)
+
+    def wait(self):
+        """Wait until all queued batches are processed."""
+        self._queue.join()
+        self._check_error()
+
+    def refresh(self):
+        """Wait for queued batches and make written documents searchable."""
+        self.wait()
+        if not self._spooling:
+            connections.get_connection().indices.refresh(index=INDEX_NAME)
+
+    def close(self):
+        """Write all queued batches and stop background writer."""
+        self.wait()
+        self._queue.put(None)
+        self._thread.join()
+        self._check_error()
+
+    @property
+    def spooling(self):
+        return self._spooling
+
+    def _check_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _drain(self):
+        while True:
+            batch = self._queue.get()
+            try:
+                if batch is None:
+                    return
+                actions, chunk_size, max_bytes = batch
+                if not self._spooling:
+                    try:
+                        helpers.bulk(connections.get_connection(), actions,
+                                     chunk_size=chunk_size,
+                                     max_chunk_bytes=max_bytes)
+                        self.written += len(actions)
+                        continue
+                    except Exception:
+                        if not self.journal_path:
+                            raise
+                        self._spooling = True
+                self._spool(actions)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _spool(self, actions):
+        if not self.journal_path:
+            raise RuntimeError("database doesn't accept documents and "
+                               "ingest journal isn't set")
+        self._spooling = True
+        append_journal(self.journal_path, actions)
+        self.spooled += len(actions)
+
+def append_journal(path, actions):
+    """Append bulk actions to journal file."""
+    with open(path, 'a') as journal:
+        for action in actions:
+            journal.write(json.dumps(action))
+            journal.write('\n')
+        journal.flush()
+        os.fsync(journal.fileno())
+
+def replay_journal(path, batch_size=500):
+    """Write documents from journal file to database. Journal is renamed
+    before replay, so that running ingest can append new journal, and is
+    removed after successful replay. Documents have ids, so journal can be
+    replayed again if replay fails.
+    Returns number of written documents."""
+    replaying_path = path + '.replaying'
+    if not os.path.exists(replaying_path):
+        os.rename(path, replaying_path)
+    # Runs are saved again with new ingest time, so cached results of their
+    # views are dropped.
+    ingest_time = datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    connection = connections.get_connection()
+    written = 0
+    with open(replaying_path) as journal:
+        actions = []
+        for line in journal:
+            if not line.strip():
+                continue
+            action = json.loads(line)
+            if action.get('_type') == 'run':
+                action['_source']['ingest_time'] = ingest_time
+            actions.append(action)
+            if len(actions) >= batch_size:
+                helpers.bulk(connection, actions, chunk_size=batch_size)
+                written += len(actions)
+                actions = []
+        if actions:
+            helpers.bulk(connection, actions, chunk_size=batch_size)
+            written += len(actions)
+    connection.indices.refresh(index=INDEX_NAME)
+    os.remove(replaying_path)
+    return written
@@ -1,6 +1,11 @@
+import itertools
+
 import runsystem.db.data as db
 import xlsxwriter
 
+# Number of loops, which related data is requested together.
+BATCH_SIZE = 500
+
 class ExcelReportGenerator(object):
     """Class for generating excel report."""
     def _inner_table(self, features_set, i):
@@ -18,9 +23,33 @@ class ExcelReportGenerator(object):
                 i += 1
         return i
 
-    def get_report(self, output):
-        db.init_database()
-        workbook = xlsxwriter.Workbook(output)
+    def _iter_loops(self, run_id, application):
+        """Iterate over loops, optionally only loops of given run
+        and application."""
+        if not run_id and not application:
+            for loop in db.Loop.search().scan():
+                yield loop
+            return
+        # Loops don't store run and application, so select them through
+        # functions.
+        s = db.Function.search()
+        if run_id:
+            s = s.query('match', run_id=run_id)
+        if application:
+            s = s.query('match', application=application)
+        function_ids = (function.meta.id for function in s.source(False).scan())
+        for ids in db.batches(function_ids, BATCH_SIZE):
+            for loop in db.Loop.search().filter('terms', function_id=ids).scan():
+                yield loop
+
+    def get_report(self, output, run_id=None, application=None, streaming=False):
+        """Write report to output file. In streaming mode all loops are
+        written and rows are flushed to file as soon as they are complete,
+        otherwise report is limited with 10000 loops."""
+        if streaming:
+            workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+        else:
+            workbook = xlsxwriter.Workbook(output)
         worksheet = workbook.add_worksheet('loops')
         bold = workbook.add_format({'bold': True})
         table_titles = ['Loop', 'Code size', 'Execution time']
@@ -28,41 +57,44 @@ class ExcelReportGenerator(object):
         for title in table_titles:
             worksheet.write(0, j, title, bold)
             j +=1
-        j = 0
-        i = 1
-        s = db.Loop.search()
-        s = s[0:10000]
-        loops = s.execute()
-        for loop in loops:
-            function = db.Function.get(id=loop.function_id)
-            worksheet.write(i, 0, ".".join((function.application, function.filename, loop.loop_id)))
-            worksheet.write(i, 1, loop.code_size)
-            worksheet.write(i, 2, loop.exec_time)
-            i +=1
         loop_features_worksheet = workbook.add_worksheet('loop_features')
-        table_titles = ['Pass', 'Place', 'numIVUsers', 'isLoopSimplifyForm', 'isEmpty', 'numIntToFloatCast', 'hasLoopPreheader', 'numTermBrBlocks', 'latchBlockTermOpcode']
+        features_titles = ['Pass', 'Place', 'numIVUsers', 'isLoopSimplifyForm', 'isEmpty', 'numIntToFloatCast', 'hasLoopPreheader', 'numTermBrBlocks', 'latchBlockTermOpcode']
         j = 0
-        for title in table_titles:
+        for title in features_titles:
             loop_features_worksheet.write(0, j, title, bold)
             j +=1
-        i = 1
         self.workbook = workbook
         self.loop_features_worksheet = loop_features_worksheet
-        for loop in loops:
-            features_sets = {}
-            function = db.Function.get(id=loop.function_id)
-            loop_features_worksheet.merge_range(i, 0, i, len(table_titles) - 1,
-                ".".join((function.application, function.filename, loop.loop_id)), bold)
-            i+=1
-            s = db.LoopFeatures.search().query('match', block_id=loop.meta.id)
-            s = s[0:10000]
-            loop_features = s.execute()
-            features_sets = {}
-            features_sets['Before'] = []
-            features_sets['After'] = []
-            for features in loop_features:
-                features_set = db.Features.get(id=features.features_id, ignore=404)
-                if features_set:
-                    features_sets[features_set.place].append(features_set)
-            i = self._inner_table(zip(features_sets['Before'], features_sets['After']), i)
-        workbook.close()
\ No newline at end of file
+
+        loops = self._iter_loops(run_id, application)
+        if not streaming:
+            loops = itertools.islice(loops, 10000)
+        # Both sheets are filled batch by batch, so rows of each sheet
+        # are written in order.
+        i = 1
+        features_i = 1
+        for loops_batch in db.batches(loops, BATCH_SIZE):
+            function_ids = list(set(loop.function_id for loop in loops_batch))
+            functions = dict((function.meta.id, function)
+                             for function in db.Function.mget(function_ids, missing='none')
+                             if function)
+            loop_features = db.LoopFeatures.search().\
+                filter('terms', block_id=[loop.meta.id for loop in loops_batch]).scan()
+            features_sets = db.get_loops_features_sets(loop_features)
+            for loop in loops_batch:
+                function = functions.get(loop.function_id)
+                if not function:
+                    continue
+                loop_name = ".".join((function.application, function.filename, loop.loop_id))
+                worksheet.write(i, 0, loop_name)
+                worksheet.write(i, 1, loop.code_size)
+                worksheet.write(i, 2, loop.exec_time)
+                i +=1
+
+                loop_features_worksheet.merge_range(features_i, 0, features_i,
+                                                    len(features_titles) - 1,
+                                                    loop_name, bold)
+                features_i += 1
+                features_i = self._inner_table(features_sets.get(loop.meta.id, []),
+                                               features_i)
+        workbook.close()
@@ -1 +1,68 @@
-__all__ = []
\ No newline at end of file
+"""
+Registry of profiler modules.
+
+Builtin profilers are packages runsystem.profilers.<name> with profiler
+module which defines profiler_class. Other profilers can be installed as
+packages registering their profiler class with 'runsystem.profilers'
+setuptools entry point:
+
+    entry_points = {
+        'runsystem.profilers': ['vtune = runsystem_vtune:VTune'],
+    }
+
+Profilers are discovered once, classes are imported on first use and
+cached.
+"""
+
+import importlib
+import os
+import pkgutil
+
+ENTRY_POINT_GROUP = 'runsystem.profilers'
+
+# {name: entry point or None for builtin profiler}
+_profilers = None
+_profiler_classes = {}
+
+def _discover():
+    profilers = {}
+    for importer, name, is_package in pkgutil.iter_modules(__path__):
+        if is_package and os.path.isfile(os.path.join(importer.path, name,
+                                                      'profiler.py')):
+            profilers[name] = None
+    try:
+        import pkg_resources
+    except ImportError:
+        return profilers
+    for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+        # Builtin profilers can't be replaced.
+        profilers.setdefault(entry_point.name, entry_point)
+    return profilers
+
+def get_profiler_names():
+    """Get sorted names of available profilers."""
+    global _profilers
+    if _profilers is None:
+        _profilers = _discover()
+    return sorted(_profilers)
+
+def get_profiler_class(name):
+    """Get class of profiler with given name. KeyError is raised for
+    unknown profiler."""
+    if name in _profiler_classes:
+        return _profiler_classes[name]
+    if name not in get_profiler_names():
+        raise KeyError("profiler %r not found" % name)
+    entry_point = _profilers[name]
+    if entry_point is None:
+        module = importlib.import_module('%s.%s.profiler' % (__name__, name))
+        profiler_class = getattr(module, 'profiler_class', None)
+        if profiler_class is None:
+            raise ImportError("no 'profiler_class' global in profiler module "
+                              "%r" % module.__name__)
+    else:
+        profiler_class = entry_point.load()
+    _profiler_classes[name] = profiler_class
+    return profiler_class
+
+__all__ = ['get_profiler_names', 'get_profiler_class']
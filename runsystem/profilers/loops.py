@@ -0,0 +1,96 @@
+"""
+Matching of loops from offset files with profiled instructions, shared by
+profiler modules.
+
+Offset files are written by compiler for each source file:
+
+    function_name
+    [offset_start, offset_end] - loop_id
+    ...
+
+where offsets are numbers of non-nop instructions from function start.
+"""
+
+import os
+import re
+from collections import namedtuple
+
+# Instruction of profiled function. Size is distance from previous
+# instruction (or function start), as it is counted by code size metric.
+InstructionRecord = namedtuple('InstructionRecord',
+                               ['address', 'size', 'samples', 'llc_misses', 'is_nop'])
+
+OFFSET_RE = re.compile(r'\[(\d+)\s*,\s*(\d+)\]\s*-\s*(\d+)')
+
+def read_offsets(offset_files, application):
+    """Read loop ranges from offset files.
+    Returns list of (function_name, full_id, offset_start, offset_end)."""
+    blocks = []
+    for offset_filename in offset_files:
+        filename = os.path.basename(offset_filename)
+        base_filename = filename.partition(".")[0]
+
+        with open(offset_filename) as offset_file:
+            current_function = None
+            for line in offset_file:
+                offset = OFFSET_RE.match(line)
+                if offset:
+                    full_id = ".".join((application, base_filename,
+                                        "llvm.loop.id" + " " + offset.group(3)))
+                    blocks.append((current_function, full_id,
+                                   int(offset.group(1)), int(offset.group(2))))
+                else:
+                    # Function name.
+                    current_function = line.rstrip()
+    return blocks
+
+def get_metrics_for_block(instructions, offset_start, offset_end):
+    """Sum metrics of instructions of loop.
+    Returns (time, code_size, llc_misses)."""
+    is_block_start_found = False
+    time_value = 0
+    llc_misses_value = 0
+    code_size_value = 0
+    cur_instr_num = 0
+    for instruction in instructions:
+        # Find start of block.
+        if not is_block_start_found:
+            if cur_instr_num == offset_start:
+                is_block_start_found = True
+                time_value = instruction.samples
+                llc_misses_value = instruction.llc_misses
+        else:
+            if cur_instr_num < offset_end:
+                time_value += instruction.samples
+                llc_misses_value += instruction.llc_misses
+            code_size_value += instruction.size
+            if cur_instr_num == offset_end:
+                break
+        if not instruction.is_nop:
+            cur_instr_num += 1
+    return (time_value, code_size_value, llc_misses_value)
+
+def count_blocks(blocks, index):
+    """Count metrics for loops read by read_offsets, index is
+    {function_name: [InstructionRecord, ...]}.
+    Returns {full_id: (function_name, time, code_size, llc_misses)}."""
+    results = {}
+    for function_name, full_id, offset_start, offset_end in blocks:
+        # Find the same part in disassembler.
+        if function_name not in index:
+            continue
+        time, code_size, llc_misses = \
+            get_metrics_for_block(index[function_name], offset_start, offset_end)
+        if full_id in results:
+            results[full_id] = (function_name, results[full_id][1] + time,
+                                results[full_id][2] + code_size,
+                                results[full_id][3] + llc_misses)
+        else:
+            results[full_id] = (function_name, time, code_size, llc_misses)
+    return results
+
+def tee(lines, output):
+    """Copy lines to output file while they are iterated."""
+    for line in lines:
+        output.write(line)
+        yield line
@@ -0,0 +1,80 @@
+"""
+Tokenizer for lines of opannotate --source --assembly listing.
+
+Instruction lines look like
+
+                   :  400500:	push   %rbp
+       12  0.0123     3  0.0456 :  400504:	mov    %rsp,%rbp
+        5  0.0100     0       0 :  400507:	mov    %edi,-0x4(%rbp)
+        0       0     2  0.0300 :  40050a:	mov    -0x4(%rbp),%eax
+
+(samples and percent for every counted event, address and instruction, zero
+percent is printed without fraction) and
+function headers look like
+
+    0000000000400500 <main>: /* main total: ... */
+
+Common formats are parsed with a strict precompiled pattern which doesn't
+backtrack, more permissive regular expression is used only for lines which
+the fast path doesn't understand.
+"""
+
+import re
+
+HEX_DIGITS = frozenset('0123456789abcdefABCDEF')
+
+HEADER_RE = re.compile(r'([0-9a-fA-F]+)\s*<')
+
+# Columns printed by opannotate: optional samples and percent for time and
+# LLC misses, address and instruction. Zero percent is a bare '0'.
+COMMON_INSTRUCTION_RE = re.compile(r' *(?:(\d+) +\d+(?:\.\d+)?(?: +(\d+) +\d+(?:\.\d+)?)?)?'
+                                   r' +: +([0-9a-fA-F]+):\s*(\w+)')
+
+# Fallback for other spacing and unusual percent column.
+INSTRUCTION_RE = re.compile(r'\s*(\d+)?\s+(\d+(?:\.\d+)?\S*)?(\s+(\d+)\s+(\d+(?:\.\d+)?\S*))?'
+                            r'\s*:\s*([0-9a-fA-F]+):\s*(\w+)')
+
+def parse_header(line):
+    """Parse function header.
+    Returns (start_address, text after '<') or None."""
+    # Headers start with address, other lines start with spaces.
+    if not line or line[0] not in HEX_DIGITS:
+        return None
+    function_header = HEADER_RE.match(line)
+    if not function_header:
+        return None
+    return (int(function_header.group(1), 16), line[function_header.end():])
+
+def parse_instruction(line):
+    """Parse instruction line.
+    Returns (address, samples, llc_misses, mnemonic) or None."""
+    result = _parse_instruction_fast(line)
+    if result is not None:
+        return result
+    # Address follows the first colon, source lines are rejected here
+    # without backtracking in the fallback pattern.
+    code = line.partition(':')[2].lstrip()
+    if not code or code[0] not in HEX_DIGITS:
+        return None
+    return _parse_instruction_slow(line)
+
+def _parse_instruction_fast(line):
+    code_line = COMMON_INSTRUCTION_RE.match(line)
+    if not code_line:
+        return None
+    samples, llc_misses, address, mnemonic = code_line.groups()
+    return (int(address, 16), int(samples) if samples else 0,
+            int(llc_misses) if llc_misses else 0, mnemonic)
+
+def _parse_instruction_slow(line):
+    code_line = INSTRUCTION_RE.match(line)
+    if not code_line:
+        return None
+    samples = 0
+    llc_misses = 0
+    if code_line.group(1):
+        samples = int(code_line.group(1))
+    if code_line.group(4):
+        llc_misses = int(code_line.group(4))
+    return (int(code_line.group(6), 16), samples, llc_misses,
+            code_line.group(7))
@@ -0,0 +1,117 @@
+"""
+Micro-benchmark for parsing of opannotate listings.
+
+Usage: python -m runsystem.profilers.oprofile.benchmark [options] LISTING...
+
+LISTING is a recorded opannotate output (.asm.oprof file from run sandbox).
+Every line is parsed as an instruction and as a function header with the
+legacy per-line regular expressions and with the annotate tokenizer.
+Results of the tokenizer are checked against the legacy regular expression,
+the only expected difference is LLC misses on lines with time samples, which
+the legacy expression recorded as 0.
+"""
+
+import re
+import sys
+import time
+from optparse import OptionParser
+
+from runsystem.profilers.oprofile import annotate
+
+LEGACY_INSTRUCTION = r'\s*(\d+)?\s+(\d+\.\d+.*)?(\s+(\d+)\s+(\d+(\.\d+)*.*))?\s*:\s*([0-9a-fA-F]+):\s*(\w+)'
+LEGACY_HEADER = r'([0-9a-fA-F]+)\s*<'
+
+def parse_legacy(lines):
+    parsed = 0
+    for line in lines:
+        if re.match(LEGACY_INSTRUCTION, line) or re.match(LEGACY_HEADER, line):
+            parsed += 1
+    return parsed
+
+def parse_legacy_instruction(line):
+    """Parse instruction line like Oprofile._count_instruction_offset_and_metrics
+    did before the tokenizer. Returns (address, samples, llc_misses,
+    mnemonic) or None."""
+    code_line = re.match(LEGACY_INSTRUCTION, line)
+    if not code_line:
+        return None
+    samples = 0
+    llc_misses = 0
+    if code_line.group(1):
+        samples = int(code_line.group(1))
+    if code_line.group(4):
+        llc_misses = int(code_line.group(4))
+    return (int(code_line.group(7), 16), samples, llc_misses,
+            code_line.group(8))
+
+def parse_tokenizer(lines):
+    parsed = 0
+    for line in lines:
+        if annotate.parse_instruction(line) or annotate.parse_header(line):
+            parsed += 1
+    return parsed
+
+def measure(parse, lines, repeat):
+    """Return best time of parsing lines."""
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        parse(lines)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def is_llc_misses_fix(legacy, parsed):
+    """Check if results differ only by LLC misses which legacy expression
+    lost after the time percent column."""
+    return (legacy is not None and parsed is not None and
+            legacy[:2] == parsed[:2] and legacy[3] == parsed[3] and
+            legacy[2] == 0 and parsed[2] != 0)
+
+def count_mismatches(lines):
+    """Compare tokenizer with legacy regex.
+    Returns (mismatches, llc_misses_fixes)."""
+    mismatches = 0
+    llc_misses_fixes = 0
+    for line in lines:
+        legacy = parse_legacy_instruction(line)
+        parsed = annotate.parse_instruction(line)
+        if parsed == legacy:
+            continue
+        if is_llc_misses_fix(legacy, parsed):
+            llc_misses_fixes += 1
+        else:
+            mismatches += 1
+    return (mismatches, llc_misses_fixes)
+
+def main():
+    parser = OptionParser("%prog [options] LISTING...")
+    parser.add_option("", "--repeat", dest="repeat", type=int, default=5,
+                      help="Number of measurements, best one is reported")
+    opts, args = parser.parse_args()
+    if not args:
+        parser.error("no listing files given")
+
+    lines = []
+    for path in args:
+        with open(path) as listing:
+            lines.extend(listing.readlines())
+    if not lines:
+        parser.error("listing files are empty")
+
+    results = [('legacy regex', measure(parse_legacy, lines, opts.repeat)),
+               ('tokenizer', measure(parse_tokenizer, lines, opts.repeat))]
+    print("%d lines" % len(lines))
+    for name, elapsed in results:
+        print("%-15s %12.0f lines/s" % (name, len(lines) / max(elapsed, 1e-9)))
+    print("speedup %.2fx" % (results[0][1] / max(results[1][1], 1e-9)))
+    mismatches, llc_misses_fixes = count_mismatches(lines)
+    print("%d lines with LLC misses lost by legacy regex" % llc_misses_fixes)
+    if mismatches:
+        print("tokenizer differs from legacy regex on %d lines" % mismatches)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
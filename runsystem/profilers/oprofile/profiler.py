@@ -1,7 +1,9 @@
 import os
-import re
 import subprocess
 from runsystem.testrunner.testrunner import Profiler
+from runsystem.profilers import loops
+from runsystem.profilers.loops import InstructionRecord
+from runsystem.profilers.oprofile import annotate
 from optparse import OptionParser, OptionGroup
 
 class Oprofile(Profiler):
@@ -12,97 +14,79 @@ class Oprofile(Profiler):
         llc_misses = 0
         instr_size = 0
 
-        code_line = re.match(r'\s*(\d+)?\s+(\d+\.\d+.*)?(\s+(\d+)\s+(\d+(\.\d+)*.*))?\s*:\s*([0-9a-fA-F]+):\s*(\w+)',
-                             line)
+        code_line = annotate.parse_instruction(line)
         if not code_line:
             print(prev_address)
             print(line)
             print("wrong format for profiler file")
 
             return (None, offset, time, instr_size, llc_misses)
-            
-        if code_line.group(1):
-            time = int(code_line.group(1))
-        if code_line.group(4):
-            llc_misses = int(code_line.group(4))
-        cur_address = int(code_line.group(7), 16)
-        instr_size = int(code_line.group(7), 16) - prev_address
+
+        cur_address, time, llc_misses, mnemonic = code_line
+        instr_size = cur_address - prev_address
         # FIX ME: check nop.
-        if code_line.group(8).startswith("nop"):
+        if mnemonic.startswith("nop"):
             offset = 0
         else:
             offset = 1
         return (cur_address, offset, time, instr_size, llc_misses)
 
-    def _get_metrics_for_block(self, assembly_lines, function_name, offset_start, offset_end):
-        start_address = None
-        is_block_start_found = False
-        time_value = 0
-        llc_misses_value = 0
-        code_size_value = 0
-        cur_instr_num = 0
+    def _find_function_header(self, line, function_names):
+        """Return (function_name, start_address) if line is a header of one
+        of required functions, otherwise (None, None)."""
+        function_header = annotate.parse_header(line)
+        if not function_header:
+            return (None, None)
+        start_address, rest = function_header
+        # Function names can contain '>' (C++ templates), so check every
+        # possible end of the name.
+        end = rest.find('>')
+        while end != -1:
+            if rest[:end] in function_names:
+                return (rest[:end], start_address)
+            end = rest.find('>', end + 1)
+        return (None, None)
+
+    def _index_assembly(self, assembly_lines, function_names):
+        """Parse disassembler listing once and build index
+        {function_name: [InstructionRecord, ...]} for required functions."""
+        index = {}
+        instructions = None
+        prev_address = None
         for assembly_line in assembly_lines:
-            if not start_address:
-                function_header = re.match(r'([0-9a-fA-F]+)\s*<' + 
-                                           re.escape(function_name) + r'>',
-                                           assembly_line)
-                if function_header:
-                    start_address = function_header.group(1)
-                    prev_address = int(start_address, 16)
-                    cur_instr_num = 0
-            else:
-                # Find start of block.
-                prev_address, cur_offset, time, prev_instr_size, llc_misses = \
+            if instructions is not None:
+                prev_address, cur_offset, time, instr_size, llc_misses = \
                     self._count_instruction_offset_and_metrics(assembly_line, prev_address)
-                if not prev_address:
-                    return (time_value, code_size_value, llc_misses_value)
-                if not is_block_start_found:
-                    if cur_instr_num == offset_start:
-                        is_block_start_found = True
-                        time_value = time
-                        llc_misses_value = llc_misses
-                else:
-                    if cur_instr_num < offset_end:
-                        time_value += time
-                        llc_misses_value += llc_misses
-                    code_size_value += prev_instr_size
-                    if cur_instr_num == offset_end:
-                        return (time_value, code_size_value, llc_misses_value)
-                cur_instr_num += cur_offset
-
-    def _count(self, offset_files):
-        results = {}
-        # Open file with disassembler.
-        with open(self._log) as assembly_file:
-            assembly_lines = assembly_file.readlines()
-            for offset_filename in offset_files:
-                filename = os.path.basename(offset_filename)
-                base_filename = filename.partition(".")[0]
-
-                with open(offset_filename) as offset_file:
-                    current_function = None
-                    for line in offset_file.readlines():
-                        offset = re.match(r'\[(\d+)\s*,\s*(\d+)\]\s*-\s*(\d+)', line)
-                        if offset:
-                            offset_value = int(offset.group(2)) - int(offset.group(1))
-                            full_id = ".".join((self._application, base_filename, 
-                                                "llvm.loop.id" + " " + offset.group(3)))
-                            # Find the same part in disassembler.
-                            metrics = self._get_metrics_for_block(assembly_lines, current_function, int(offset.group(1)), int(offset.group(2)))
-                            if metrics:
-                                time, code_size, llc_misses = metrics
-                                if full_id in results:
-                                    results[full_id] = (current_function, results[full_id][1] + time,
-                                                        results[full_id][2] + code_size,
-                                                        results[full_id][3] + llc_misses)
-                                else:
-                                    results[full_id] = (current_function, time, code_size, llc_misses)
-                        else:
-                            # Function name.
-                            current_function = line.rstrip()
-        return results
+                if prev_address:
+                    instructions.append(InstructionRecord(prev_address, instr_size,
+                                                          time, llc_misses,
+                                                          cur_offset == 0))
+                    continue
+                # End of function body.
+                instructions = None
+            function_name, start_address = \
+                self._find_function_header(assembly_line, function_names)
+            # Only the first listing of function is used.
+            if function_name and function_name not in index:
+                instructions = []
+                index[function_name] = instructions
+                prev_address = start_address
+        return index
+
+    def _count(self, offset_files, assembly_lines=None):
+        """Count metrics for loops. Listing is consumed line by line from
+        assembly_lines, or from log file if they aren't given."""
+        blocks = loops.read_offsets(offset_files, self._application)
+        function_names = set(block[0] for block in blocks)
+        if assembly_lines is None:
+            # Open file with disassembler.
+            with open(self._log) as assembly_file:
+                index = self._index_assembly(assembly_file, function_names)
+        else:
+            index = self._index_assembly(assembly_lines, function_names)
+        return loops.count_blocks(blocks, index)
 
-    def run(self, args, offset_files):
+    def _parse_options(self, args):
         parser = OptionParser("operf [options] ")
         group = OptionGroup(parser, "Oprofile options")
         group.add_option("", "--oprof-counter", dest="counter",
@@ -117,30 +101,55 @@ class Oprofile(Profiler):
         parser.add_option_group(group)
 
         (opts, args) = parser.parse_args(args)
+        return opts
 
-        operf_command = "operf"
-        opannotate_command = "opannotate"
-
+    def _get_command(self, command):
         # Get full path if commands aren't in PATH.
         if not self._path:
-            operf_command = os.path.join(self._path, operf_command)
-            opannotate_command = os.path.join(self._path, opannotate_command)
+            return os.path.join(self._path, command)
+        return command
+
+    def _session_dir(self):
+        # Each measurement (log file) gets its own session, so that its
+        # samples are not overwritten while it is waiting for
+        # post-processing.
+        return os.path.splitext(self._log)[0] + ".oprofile_data"
+
+    def measure(self, args):
+        opts = self._parse_options(args)
 
         # operf -e CPU_CLK_UNHALTED:100000:0:0:1 --callgraph [run_line]
-        cmd = [operf_command, 
+        cmd = [self._get_command("operf"),
+               '--session-dir=' + self._session_dir(),
                '-e', ":".join(('LLC_MISSES', str(opts.llc_num))), 
                '-e', ":".join(('CPU_CLK_UNHALTED', str(opts.count_num), "0:0:1"))]
         cmd.extend(self._run_line.split())
+        cmd = self._prepare_command(cmd)
         with open("/dev/null") as input_file:
             subprocess.check_call(cmd, stdin=input_file)
 
+    def analyze(self, args, offset_files):
         # opannotate --source --assembly [run_line]
-        cmd = [opannotate_command, '--source', '--assembly']
+        cmd = [self._get_command("opannotate"),
+               '--session-dir=' + self._session_dir(),
+               '--source', '--assembly']
         cmd.extend(self._run_line.split())
-        with open(self._log, 'w+') as assembly_file:
-            subprocess.check_call(cmd, stdout=assembly_file)
+        # Listing is parsed while opannotate writes it and is copied to log
+        # file, so the whole listing is never kept in memory.
+        with open(self._log, 'w') as assembly_file:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+            try:
+                results = self._count(offset_files,
+                                      loops.tee(process.stdout, assembly_file))
+            finally:
+                process.stdout.close()
+                retcode = process.wait()
+        if retcode:
+            raise subprocess.CalledProcessError(retcode, cmd)
+        return results
 
+    def parse(self, args, offset_files):
+        # Listing saved to log file by analyze().
         return self._count(offset_files)
 
-
 profiler_class = Oprofile
\ No newline at end of file
@@ -0,0 +1,174 @@
+import os
+import re
+import subprocess
+from runsystem.testrunner.testrunner import Profiler
+from runsystem.profilers import loops
+from runsystem.profilers.loops import InstructionRecord
+from optparse import OptionParser, OptionGroup
+
+# Lines of objdump -d --no-show-raw-insn output.
+OBJDUMP_HEADER_RE = re.compile(r'([0-9a-fA-F]+) <(.+)>:\s*$')
+OBJDUMP_INSTRUCTION_RE = re.compile(r'\s*([0-9a-fA-F]+):\s+(\S+)')
+
+class Perf(Profiler):
+
+    def _parse_options(self, args):
+        parser = OptionParser("perf [options] ")
+        group = OptionGroup(parser, "Perf options")
+        group.add_option("", "--perf-cycles-event", dest="cycles_event",
+                         help="Event which is used for execution time",
+                         type=str, default="cycles")
+        group.add_option("", "--perf-cycles-num", dest="cycles_num",
+                         help="Sample period for execution time event",
+                         type=int, default=100000)
+        group.add_option("", "--perf-llc-event", dest="llc_event",
+                         help="Event which is used for LLC misses",
+                         type=str, default="cache-misses")
+        group.add_option("", "--perf-llc-num", dest="llc_num",
+                         help="Sample period for LLC misses event",
+                         type=int, default=10000)
+        group.add_option("", "--objdump", dest="objdump",
+                         help="Disassembler for profiled executables",
+                         type=str, default="objdump")
+        parser.add_option_group(group)
+
+        (opts, args) = parser.parse_args(args)
+        return opts
+
+    def _get_command(self):
+        # Profiler path points to perf executable.
+        if self._path:
+            return self._path
+        return "perf"
+
+    def _data_file(self):
+        # Each measurement (log file) gets its own data file.
+        return os.path.splitext(self._log)[0] + ".perf.data"
+
+    def _executable(self):
+        return self._run_line.split()[0]
+
+    def _event_name(self, event):
+        # Remove modifiers and terms: cycles/period=N/:u -> cycles.
+        return event.split('/')[0].split(':')[0]
+
+    def _parse_samples(self, sample_lines, opts, function_names):
+        """Count samples of required functions of profiled executable from
+        perf script output.
+        Returns {(function_name, offset): [time, llc_misses]}."""
+        executable = os.path.basename(self._executable())
+        metrics = {self._event_name(opts.cycles_event): 0,
+                   self._event_name(opts.llc_event): 1}
+        samples = {}
+        for line in sample_lines:
+            # Line format: "event: symbol+0xoffset (dso)".
+            event, colon, rest = line.partition(': ')
+            symbol, space, dso = rest.strip().rpartition(' ')
+            if not colon or not dso.startswith('('):
+                continue
+            if os.path.basename(dso.strip('()')) != executable:
+                continue
+            metric = metrics.get(self._event_name(event.strip()))
+            function_name, plus, offset = symbol.rpartition('+0x')
+            if metric is None or not plus or function_name not in function_names:
+                continue
+            key = (function_name, int(offset, 16))
+            if key not in samples:
+                samples[key] = [0, 0]
+            samples[key][metric] += 1
+        return samples
+
+    def _index_executable(self, opts, function_names, samples):
+        """Disassemble profiled executable and build index
+        {function_name: [InstructionRecord, ...]} for required functions."""
+        cmd = [opts.objdump, '-d', '--no-show-raw-insn', self._executable()]
+        index = {}
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        try:
+            instructions = None
+            for line in process.stdout:
+                if instructions is not None:
+                    if not line.strip():
+                        # End of function body.
+                        instructions = None
+                        continue
+                    code_line = OBJDUMP_INSTRUCTION_RE.match(line)
+                    if not code_line:
+                        continue
+                    address = int(code_line.group(1), 16)
+                    metrics = samples.get((function_name, address - start_address),
+                                          (0, 0))
+                    instructions.append(InstructionRecord(
+                        address, address - prev_address, metrics[0], metrics[1],
+                        code_line.group(2).startswith("nop")))
+                    prev_address = address
+                    continue
+                function_header = OBJDUMP_HEADER_RE.match(line)
+                if function_header:
+                    function_name = function_header.group(2)
+                    # Only the first listing of function is used.
+                    if function_name in function_names and function_name not in index:
+                        instructions = []
+                        index[function_name] = instructions
+                        start_address = int(function_header.group(1), 16)
+                        prev_address = start_address
+        finally:
+            process.stdout.close()
+            retcode = process.wait()
+        if retcode:
+            raise subprocess.CalledProcessError(retcode, cmd)
+        return index
+
+    def _count(self, opts, offset_files, sample_lines=None):
+        """Count metrics for loops. Samples are consumed line by line from
+        sample_lines, or from log file if they aren't given."""
+        blocks = loops.read_offsets(offset_files, self._application)
+        function_names = set(block[0] for block in blocks)
+        if sample_lines is None:
+            with open(self._log) as samples_file:
+                samples = self._parse_samples(samples_file, opts, function_names)
+        else:
+            samples = self._parse_samples(sample_lines, opts, function_names)
+        index = self._index_executable(opts, function_names, samples)
+        return loops.count_blocks(blocks, index)
+
+    def measure(self, args):
+        opts = self._parse_options(args)
+
+        # perf record -o [data] -e cycles/period=100000/ [run_line]
+        cmd = [self._get_command(), 'record', '-q',
+               '-o', self._data_file(),
+               '-e', '%s/period=%d/' % (opts.cycles_event, opts.cycles_num),
+               '-e', '%s/period=%d/' % (opts.llc_event, opts.llc_num)]
+        cmd.extend(self._run_line.split())
+        cmd = self._prepare_command(cmd)
+        with open("/dev/null") as input_file:
+            subprocess.check_call(cmd, stdin=input_file)
+
+    def analyze(self, args, offset_files):
+        opts = self._parse_options(args)
+
+        # Offsets in symbols don't depend on load address, so position
+        # independent executables are handled too. Names aren't demangled
+        # to match names in offset files.
+        cmd = [self._get_command(), 'script', '-i', self._data_file(),
+               '-F', 'event,sym,symoff,dso', '--no-demangle']
+        # Samples are parsed while perf writes them and are copied to log
+        # file, so that parse() can use them later.
+        with open(self._log, 'w') as samples_file:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+            try:
+                results = self._count(opts, offset_files,
+                                      loops.tee(process.stdout, samples_file))
+            finally:
+                process.stdout.close()
+                retcode = process.wait()
+        if retcode:
+            raise subprocess.CalledProcessError(retcode, cmd)
+        return results
+
+    def parse(self, args, offset_files):
+        # Samples saved to log file by analyze().
+        return self._count(self._parse_options(args), offset_files)
+
+profiler_class = Perf
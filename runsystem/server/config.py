@@ -15,8 +15,13 @@ class Config:
         # If the path does not contain database type, assume relative path.
         dbDirPath = dbDir
 
+        cacheDir = data.get('result_cache_dir')
+        if cacheDir:
+            cacheDir = os.path.join(baseDir, cacheDir)
+
         return Config(data.get('name', 'Runsystem'), data['zorgURL'],
-                      dbDir, os.path.join(baseDir, profileDir))
+                      dbDir, os.path.join(baseDir, profileDir),
+                      data.get('result_cache_size', 1024), cacheDir)
     
     @staticmethod
     def dummyInstance():
@@ -26,11 +31,14 @@ class Config:
         
         return Config('Runsystem', 'http://localhost:8000', dbDir, profileDirPath)
     
-    def __init__(self, name, zorgURL, dbDir, profileDir):
+    def __init__(self, name, zorgURL, dbDir, profileDir, cacheSize=1024,
+                 cacheDir=None):
         self.name = name
         self.zorgURL = zorgURL
         self.dbDir = dbDir
         self.profileDir = profileDir
+        self.cacheSize = cacheSize
+        self.cacheDir = cacheDir
         while self.zorgURL.endswith('/'):
             self.zorgURL = zorgURL[:-1]
 
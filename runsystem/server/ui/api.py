@@ -1,248 +1,184 @@
-from flask import current_app, g
-from flask import request
-from flask_restful import Resource, reqparse, fields, marshal_with, abort
-import json
-parser = reqparse.RequestParser()
-parser.add_argument('db', type=str)
-
-
-def in_db(func):
-    """Extract the database information off the request and attach to
-    particular test suite and database."""
-    def wrap(*args, **kwargs):
-        db = kwargs.pop('db')
-        ts = kwargs.pop('ts')
-        g.db_name = db
-        g.testsuite_name = ts
-        g.db_info = current_app.old_config.databases.get(g.db_name)
-        if g.db_info is None:
-            abort(404, message="Invalid database.")
-        # Compute result.
-        result = func(*args, **kwargs)
-
-        # Make sure that any transactions begun by this request are finished.
-        request.get_db().rollback()
-        return result
-    return wrap
-
-
-def ts_path(path):
-    """Make a URL path with a database and test suite embedded in them."""
-    return "/api/db_<string:db>/v4/<string:ts>/" + path
-
-
-def with_ts(obj):
-    """For Url type fields to work, the objects we return must have a test-suite
-    and database attribute set, the function attempts to set them."""
-    if type(obj) == list:
-        # For lists, set them on all elements.
-        return [with_ts(x) for x in obj]
-    if type(obj) == dict:
-        # If already a dict, just add the fields.
-        new_obj = obj
-    else:
-        # Sqlalcamey objects are read-only and store their attributes in a
-        # sub-dict.  Make a copy so we can edit it.
-        new_obj = obj.__dict__.copy()
-
-    new_obj['db'] = g.db_name
-    new_obj['ts'] = g.testsuite_name
-    return new_obj
-
-
-# This date format is what the JavaScript in the LNT frontend likes.
-DATE_FORMAT = "iso8601"
-
-
-machines_fields = {
-    'id': fields.Integer,
-    'name': fields.String,
-    'os': fields.String,
-    'hardware': fields.String,
-}
-
-
-class Machines(Resource):
-    """List all the machines and give summary information."""
-    method_decorators = [in_db]
-
-    @marshal_with(machines_fields)
-    def get(self):
-        ts = request.get_testsuite()
-        changes = ts.query(ts.Machine).all()
-        return changes
-
-
-machine_fields = {
-    'id': fields.Integer,
-    'name': fields.String,
-    'os': fields.String,
-    'hardware': fields.String,
-    'runs': fields.List(fields.Url('runs')),
-}
+from flask_restful import Resource, reqparse, fields, marshal, marshal_with, abort
+from elasticsearch_dsl import Q
 
+import runsystem.db.data as db
 
-class Machine(Resource):
-    """Detailed results about a particular machine, including runs on it."""
-    method_decorators = [in_db]
+# Elasticsearch doesn't return hits after this position (index
+# max_result_window).
+MAX_RESULT_WINDOW = 10000
+MAX_LIMIT = 1000
+MAX_APPLICATIONS = 100
 
-    @marshal_with(machine_fields)
-    def get(self, machine_id):
 
-        ts = request.get_testsuite()
-        try:
-            machine = ts.query(ts.Machine).filter(
-                    ts.Machine.id == machine_id).one()
-        except NoResultFound:
-            abort(404, message="Invalid machine.")
+def api_path(path):
+    """Make a URL path of API resource."""
+    return "/api/v1/" + path
 
-        machine = with_ts(machine)
-        machine_runs = ts.query(ts.Run.id).join(ts.Machine).filter(
-                ts.Machine.id == machine_id).all()
 
-        machine['runs'] = with_ts([dict(run_id=x[0]) for x in machine_runs])
-        print machine['runs']
-        return machine
+def get_run(run_id):
+    run = db.Run.get(id=run_id, ignore=404)
+    if run is None:
+        abort(404, message="Invalid run.")
+    return run
 
 
 run_fields = {
-    'id': fields.Integer,
-    'start_time': fields.DateTime(dt_format=DATE_FORMAT),
-    'end_time': fields.DateTime(dt_format=DATE_FORMAT),
-    'machine_id': fields.Integer,
-    'machine': fields.Url("machine"),
-    'order_id': fields.Integer,
-    'order': fields.Url("order"),
+    'id': fields.String(attribute=lambda run: run.meta.id),
+    'options': fields.String,
+    'date_time': fields.String,
+    'connected_run_id': fields.String,
+    'ingest_time': fields.String,
+    'noisy': fields.Boolean,
 }
 
 
 class Runs(Resource):
-    method_decorators = [in_db]
+    """List all runs."""
+
+    @marshal_with(run_fields)
+    def get(self):
+        s = db.Run.search()
+        s = s[0:MAX_RESULT_WINDOW]
+        return list(s.execute())
+
+
+class Run(Resource):
+    """Information about run."""
 
     @marshal_with(run_fields)
     def get(self, run_id):
-        ts = request.get_testsuite()
-        try:
-            changes = ts.query(ts.Run).join(ts.Machine).filter(
-                ts.Run.id == run_id).one()
-        except NoResultFound:
-            abort(404, message="Invalid run.")
-
-        changes = with_ts(changes)
-        return changes
-
-
-order_fields = {
-    'id': fields.Integer,
-    'llvm_project_revision': fields.String,
-    'next_order_id': fields.Integer,
-    'previous_order_id': fields.Integer,
+        return get_run(run_id)
+
+
+loop_delta_fields = {
+    'id': fields.String(attribute='block_id'),
+    'compared_id': fields.String(attribute='compared_block_id'),
+    'loop_id': fields.String,
+    'function_id': fields.String,
+    'function_name': fields.String,
+    'application': fields.String,
+    'filename': fields.String,
+    'exec_time': fields.Integer,
+    'code_size': fields.Integer,
+    'llc_misses': fields.Integer,
+    'compared_exec_time': fields.Integer,
+    'compared_code_size': fields.Integer,
+    'compared_llc_misses': fields.Integer,
+    'exec_time_delta': fields.Integer,
+    'code_size_delta': fields.Integer,
+    'llc_misses_delta': fields.Integer,
+    'speedup': fields.Float,
 }
 
+changes_parser = reqparse.RequestParser()
+changes_parser.add_argument('metric', type=str, default='exec_time',
+                            choices=db.LOOP_METRICS)
+changes_parser.add_argument('compare_to', type=str)
+changes_parser.add_argument('application', type=str)
+changes_parser.add_argument('limit', type=int, default=50)
+changes_parser.add_argument('offset', type=int, default=0)
+
+
+def check_loop_deltas(run_id, compared_run_id):
+    """Abort if loop deltas aren't stored for pair of runs."""
+    s = db.LoopDelta.search().\
+        filter('term', run_id=run_id).\
+        filter('term', compared_run_id=compared_run_id)
+    if s.count():
+        return
+    get_run(compared_run_id)
+    abort(404, message="Loop deltas aren't computed for runs, use "
+                       "'runsystem compute-loop-deltas --run-id %s "
+                       "--compared-run-id %s'." % (run_id, compared_run_id))
+
+
+class LoopChanges(Resource):
+    """Loops of run sorted by change of metric against compared run
+    (connected run by default), from stored loop deltas. Summary is
+    aggregated over all matched loops of runs."""
+    # Regressions are increases of metric, improvements are decreases.
+    regressions = True
 
-class Order(Resource):
-    method_decorators = [in_db]
-
-    @marshal_with(order_fields)
-    def get(self, order_id):
-        ts = request.get_testsuite()
-        try:
-            changes = ts.query(ts.Order).filter(ts.Order.id == order_id).one()
-        except NoResultFound:
-            abort(404, message="Invalid order.")
-        return changes
-
-
-class Graph(Resource):
-    """List all the machines and give summary information."""
-    method_decorators = [in_db]
-
-    def get(self, machine_id, test_id, field_index):
-        """Get the data for a particular line in a graph."""
-        ts = request.get_testsuite()
-        # Maybe we don't need to do this?
-        try:
-            machine = ts.query(ts.Machine) \
-                .filter(ts.Machine.id == machine_id) \
-                .one()
-            test = ts.query(ts.Test) \
-                .filter(ts.Test.id == test_id) \
-                .one()
-            field = ts.sample_fields[field_index]
-        except NoResultFound:
-            return abort(404)
-
-        q = ts.query(field.column, ts.Order.llvm_project_revision, ts.Run.start_time, ts.Run.id) \
-            .join(ts.Run) \
-            .join(ts.Order) \
-            .filter(ts.Run.machine_id == machine.id) \
-            .filter(ts.Sample.test == test) \
-            .filter(field.column != None) \
-            .order_by(ts.Order.llvm_project_revision.desc())
-
-        if field.status_field:
-            q = q.filter((field.status_field.column == PASS) |
-                         (field.status_field.column == None))
-        
-        limit = request.args.get('limit', None)
-        if limit:
-            limit = int(limit)
-            if limit:
-                q = q.limit(limit)
-        
-        samples = [[rev, val, {'label': rev, 'date': str(time), 'runID': str(rid)}] for val, rev, time, rid in q.all()[::-1]]
-
-        return samples
-
-
-class Regression(Resource):
-    """List all the machines and give summary information."""
-    method_decorators = [in_db]
-
-    def get(self, machine_id, test_id, field_index):
-        """Get the regressions for a particular line in a graph."""
-        ts = request.get_testsuite()
-        field = ts.sample_fields[field_index]
-        # Maybe we don't need to do this?
-        fcs = ts.query(ts.FieldChange) \
-            .filter(ts.FieldChange.machine_id == machine_id) \
-            .filter(ts.FieldChange.test_id == test_id) \
-            .filter(ts.FieldChange.field_id == field.id) \
-            .all()
-        fc_ids = [x.id for x in fcs]
-        fc_mappings = dict([(x.id, (x.end_order.as_ordered_string(), x.new_value)) for x in fcs])
-        if len(fcs) == 0:
-            # If we don't find anything, lets see if we are even looking
-            # for a valid thing to provide a nice error.
-            try:
-                machine = ts.query(ts.Machine) \
-                    .filter(ts.Machine.id == machine_id) \
-                    .one()
-                test = ts.query(ts.Test) \
-                    .filter(ts.Test.id == test_id) \
-                    .one()
-                field = ts.sample_fields[field_index]
-            except NoResultFound:
-                return abort(404)
-            # I think we found nothing.
-            return []
-        regressions = ts.query(ts.Regression.title, ts.Regression.id, ts.RegressionIndicator.field_change_id, ts.Regression.state) \
-            .join(ts.RegressionIndicator) \
-            .filter(ts.RegressionIndicator.field_change_id.in_(fc_ids)) \
-            .all()
-        results = [{'title': r.title,
-                    'id': r.id, 
-                    'state': r.state, 
-                    'end_point': fc_mappings[r.field_change_id]} for r in regressions]
-        return results
+    def get(self, run_id):
+        args = changes_parser.parse_args()
+        if args.limit < 1 or args.limit > MAX_LIMIT:
+            abort(400, message="limit should be from 1 to %d." % MAX_LIMIT)
+        if args.offset < 0 or args.offset + args.limit > MAX_RESULT_WINDOW:
+            abort(400, message="offset + limit should be at most %d." %
+                  MAX_RESULT_WINDOW)
+        run = get_run(run_id)
+        compared_run_id = args.compare_to or run.connected_run_id
+        if not compared_run_id:
+            abort(400, message="Run has no connected run, use compare_to.")
+
+        # Deltas are checked before application filter, which may match no
+        # loops.
+        check_loop_deltas(run_id, compared_run_id)
+
+        delta_field = args.metric + '_delta'
+        s = db.LoopDelta.search().\
+            filter('term', run_id=run_id).\
+            filter('term', compared_run_id=compared_run_id)
+        if args.application:
+            s = s.filter('term', application=args.application)
+        # Aggregations are computed for all loops, hits only for changed.
+        s.aggs.metric('loops', 'value_count', field='block_id')
+        s.aggs.metric('delta', 'sum', field=delta_field)
+        s.aggs.metric('speedup', 'avg', field='speedup')
+        s.aggs.bucket('regressions', 'filter',
+                      Q('range', **{delta_field: {'gt': 0}})).\
+            metric('delta', 'sum', field=delta_field)
+        s.aggs.bucket('improvements', 'filter',
+                      Q('range', **{delta_field: {'lt': 0}})).\
+            metric('delta', 'sum', field=delta_field)
+        s.aggs.bucket('applications', 'terms', field='application',
+                      size=MAX_APPLICATIONS).\
+            metric('delta', 'sum', field=delta_field)
+        if self.regressions:
+            s = s.post_filter('range', **{delta_field: {'gt': 0}})
+            s = s.sort({delta_field: {'order': 'desc'}})
+        else:
+            s = s.post_filter('range', **{delta_field: {'lt': 0}})
+            s = s.sort({delta_field: {'order': 'asc'}})
+        s = s[args.offset:args.offset + args.limit]
+        response = s.execute()
+
+        aggregations = response.aggregations
+        return {
+            'run_id': run_id,
+            'compared_run_id': compared_run_id,
+            'metric': args.metric,
+            'total': response.hits.total,
+            'offset': args.offset,
+            'limit': args.limit,
+            'loops': marshal(list(response), loop_delta_fields),
+            'summary': {
+                'loops': int(aggregations.loops.value),
+                'delta': aggregations.delta.value,
+                'speedup': aggregations.speedup.value,
+                'regressions': aggregations.regressions.doc_count,
+                'regressions_delta': aggregations.regressions.delta.value,
+                'improvements': aggregations.improvements.doc_count,
+                'improvements_delta': aggregations.improvements.delta.value,
+                'applications': dict((bucket.key, {'loops': bucket.doc_count,
+                                                   'delta': bucket.delta.value})
+                                     for bucket in aggregations.applications.buckets),
+            },
+        }
+
+
+class LoopRegressions(LoopChanges):
+    """Loops with the largest increase of metric."""
+    regressions = True
+
+
+class LoopImprovements(LoopChanges):
+    """Loops with the largest decrease of metric."""
+    regressions = False
 
 
 def load_api_resources(api):
-    api.add_resource(Machines, ts_path("machines"))
-    api.add_resource(Machine, ts_path("machine/<int:machine_id>"))
-    api.add_resource(Runs, ts_path("run/<int:run_id>"))
-    api.add_resource(Order, ts_path("order/<int:order_id>"))
-    graph_url = "graph/<int:machine_id>/<int:test_id>/<int:field_index>"
-    api.add_resource(Graph, ts_path(graph_url))
-    regression_url = "regression/<int:machine_id>/<int:test_id>/<int:field_index>"
-    api.add_resource(Regression, ts_path(regression_url))
+    api.add_resource(Runs, api_path("runs"))
+    api.add_resource(Run, api_path("run/<string:run_id>"))
+    api.add_resource(LoopRegressions, api_path("run/<string:run_id>/regressions"))
+    api.add_resource(LoopImprovements, api_path("run/<string:run_id>/improvements"))
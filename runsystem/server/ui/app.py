@@ -19,6 +19,7 @@ from flask_restful import Resource, Api
 import runsystem.server.instance
 import runsystem.server.ui.globals
 import runsystem.server.ui.views
+from runsystem.server.ui.cache import ResultCache
 from runsystem.server.ui.api import load_api_resources
 
 class RootSlashPatchMiddleware(object):
@@ -111,6 +112,10 @@ class App(ExceptionLoggerFlask):
             app=current_app,
             old_config=self.old_config)
 
+        # Cache for results of queries to finished runs.
+        self.result_cache = ResultCache(self.old_config.cacheSize,
+                                        self.old_config.cacheDir)
+
     def start_file_logging(self):
         """Start server production logging.  At this point flask already logs
         to stderr, so just log to a file as well.
@@ -0,0 +1,146 @@
+"""
+Cache for results of queries to data of finished runs.
+
+Data of run doesn't change after the run is saved, so results computed for
+views can be reused until the run is ingested again. Every entry is stored
+with ingest stamps of all runs it is computed from, entries of run are
+dropped when its stamp changes.
+"""
+
+import collections
+import cPickle as pickle
+import glob
+import hashlib
+import os
+import threading
+
+class ResultCache(object):
+    """LRU cache with optional on-disk storage.
+
+    Cached values should be plain data (dicts, lists, strings, numbers),
+    because they are pickled to disk."""
+
+    def __init__(self, max_size=1024, cache_dir=None, max_disk_size=10000):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.max_disk_size = max_disk_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        # Ingest stamp of each run, which entries are stored.
+        self._stamps = {}
+        self._lock = threading.Lock()
+        # Paths of entries on disk from the oldest, loaded once, so misses
+        # don't scan cache directory.
+        self._disk_entries = collections.OrderedDict()
+        if self.cache_dir:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            paths = glob.glob(os.path.join(self.cache_dir, '*.pickle'))
+            paths.sort(key=os.path.getmtime)
+            for path in paths:
+                self._disk_entries[path] = True
+
+    def get(self, runs, name, params, compute):
+        """Get value of view part with given name and parameters computed
+        from runs, which are [(run_id, stamp), ...], compute() is called if
+        value isn't cached."""
+        runs = tuple(runs)
+        key = (runs, name, tuple(sorted(params.items())))
+        with self._lock:
+            for run_id, stamp in runs:
+                if self._stamps.get(run_id, stamp) != stamp:
+                    self._invalidate(run_id)
+                self._stamps[run_id] = stamp
+            if key in self._entries:
+                value = self._entries.pop(key)
+                self._entries[key] = value
+                self.hits += 1
+                return value
+            value = self._load(key)
+            if value is not None:
+                self._store(key, value)
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._store(key, value)
+            self._save(key, value)
+        return value
+
+    def invalidate(self, run_id):
+        """Drop all entries of run."""
+        with self._lock:
+            self._invalidate(run_id)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self._entries),
+                    'max_size': self.max_size}
+
+    def _invalidate(self, run_id):
+        for key in [key for key in self._entries
+                    if run_id in [entry_run for entry_run, stamp in key[0]]]:
+            del self._entries[key]
+        self._stamps.pop(run_id, None)
+        if self.cache_dir:
+            prefix = self._run_prefix(run_id)
+            for path in [path for path in self._disk_entries
+                         if prefix in os.path.basename(path)]:
+                self._remove(path)
+
+    def _store(self, key, value):
+        self._entries[key] = value
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _run_prefix(self, run_id):
+        return hashlib.sha1(str(run_id)).hexdigest()
+
+    def _path(self, key):
+        # File name has prefixes of all runs, so it's found when any of them
+        # is invalidated.
+        prefixes = '-'.join(self._run_prefix(run_id) for run_id, stamp in key[0])
+        return os.path.join(self.cache_dir, '%s.%s.pickle' % (
+            prefixes, hashlib.sha1(repr(key)).hexdigest()))
+
+    def _load(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as cache_file:
+                stored_key, value = pickle.load(cache_file)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+        if stored_key != key:
+            return None
+        return value
+
+    def _save(self, key, value):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        with open(path, 'wb') as cache_file:
+            pickle.dump((key, value), cache_file, pickle.HIGHEST_PROTOCOL)
+        self._disk_entries.pop(path, None)
+        self._disk_entries[path] = True
+        # Remove the oldest entries if disk storage is full.
+        while len(self._disk_entries) > self.max_disk_size:
+            self._remove(next(iter(self._disk_entries)))
+
+    def _remove(self, path):
+        self._disk_entries.pop(path, None)
+        try:
+            os.remove(path)
+        except OSError:
+            # File can be already removed by other process.
+            pass
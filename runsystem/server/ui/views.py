@@ -37,7 +37,6 @@ def favicon_ico():
 
 @frontend.route('/')
 def index():
-    db.init_database()
     runs = db.Run.search().execute()
     return render_template("index.html", runs=runs)
 
@@ -62,39 +61,49 @@ class CompareRequestInfo(object):
         if compared_loop:
             self.compared_loop = db.Loop.get(id=compared_loop)
 
+def dump_documents(documents):
+    """Convert documents to plain data, which can be stored in cache."""
+    return [(type(document).__name__, document.to_dict(include_meta=True))
+            for document in documents]
+
+def load_documents(dumped_documents):
+    """Restore documents converted by dump_documents."""
+    return [getattr(db, doc_class).from_es(document)
+            for doc_class, document in dumped_documents]
+
+def get_cached(runs, name, params, compute):
+    """Get result of compute() for view part from result cache. Entry is
+    valid while given runs aren't ingested again."""
+    cache = getattr(current_app, 'result_cache', None)
+    if cache is None:
+        return compute()
+    # Data of runs which are still being saved changes without new ingest
+    # time.
+    if any(run.ingesting for run in runs):
+        return compute()
+    return cache.get([(run.meta.id, run.ingest_time) for run in runs],
+                     name, params, compute)
+
 @frontend.route("/run/<id>")
 def run(id):
     run = db.Run.get(id=id)
-    s = db.ApplicationSearch(run_id=id)
-    response = s.execute()
-    applications = {}
-    for (application_name, _, _) in response.facets.tags:
-        applications[application_name] = []
-        s = db.FilenameSearch(application=application_name)
-        filenames_response = s.execute()
-        for (filename, _, _) in filenames_response.facets.tags:
-            applications[application_name].append(filename)
-
     request_info = CompareRequestInfo(run)
+    runs = [run]
+    if request_info.compare_to:
+        runs.append(request_info.compare_to)
+    applications_trees = get_cached(runs, 'applications',
+                                    {'compare_to': runs[-1].meta.id},
+                                    lambda: db.get_applications([cur_run.meta.id for cur_run in runs]))
+    applications = applications_trees[0]
     compare_to_applications = {}
     if request_info.compare_to:
-        s = db.ApplicationSearch(run_id=request_info.compare_to.meta.id)
-        response = s.execute()
-        for (application_name, _, _) in response.facets.tags:
-            compare_to_applications[application_name] = []
-            s = db.FilenameSearch(application=application_name)
-            filenames_response = s.execute()
-            for (filename, _, _) in filenames_response.facets.tags:
-                compare_to_applications[application_name].append(filename)
-    
+        compare_to_applications = applications_trees[1]
+
     return render_template("run.html", run=run, applications=applications, 
                                        request_info=request_info,
                                        compare_to_applications=compare_to_applications)
 
-@frontend.route("/program/<name>/<id>")
-def program(name, id):
-    run = db.Run.get(id=id)
-    request_info = CompareRequestInfo(run)
+def get_program_functions(id, name, request_info):
     s = db.Function.search().query('match', run_id=id).query('match', application=name)
     s = s[0:10000]
     functions = s.execute()
@@ -106,37 +115,97 @@ def program(name, id):
         s = s[0:10000]
         compared_functions = s.execute()
         compare_to_functions = [o.function_name for o in compared_functions]
+    return (dump_documents(functions), compare_to_functions)
+
+@frontend.route("/program/<name>/<id>")
+def program(name, id):
+    run = db.Run.get(id=id)
+    request_info = CompareRequestInfo(run)
+    runs = [run]
+    if request_info.compare_to:
+        runs.append(request_info.compare_to)
+    functions, compare_to_functions = \
+        get_cached(runs, 'program', {'name': name, 'compare_to': runs[-1].meta.id},
+                   lambda: get_program_functions(id, name, request_info))
+    functions = load_documents(functions)
     
     return render_template("program.html", program=name, functions=functions,
                                            request_info=request_info, 
                                            compare_to_functions=compare_to_functions)
 
+def find_compare_to_loops(request_info, function):
+    compare_to_loops = []
+    # Stored loop deltas are used if they are computed for these runs.
+    s = db.LoopDelta.search().\
+                            filter('term', function_id=function.meta.id).\
+                            filter('term', compared_run_id=request_info.compare_to.meta.id)
+    s = s[0:10000]
+    deltas = s.execute()
+    if len(deltas):
+        return dump_documents(delta.get_compared_loop() for delta in deltas)
+    # Try denormalized loops.
+    s = db.RunLoop.search().\
+                          query('match', run_id=request_info.compare_to.meta.id).\
+                          query('match', function_name=function.function_name).\
+                          query('match', application=function.application).\
+                          query('match', filename=function.filename)
+    s = s[0:10000]
+    response_loops = s.execute()
+    if len(response_loops):
+        return dump_documents(response_loops)
+    s = db.Function.search().\
+                           query('match', run_id=request_info.compare_to.meta.id).\
+                           query('match', function_name=function.function_name).\
+                           query('match', application=function.application).\
+                           query('match', filename=function.filename)
+    response = s.execute()
+    if response.success() and len(response):
+        compare_to_function = response[0]
+        s = db.Loop.search().query('match', function_id=compare_to_function.meta.id)
+        s = s[0:10000]
+        compare_to_loops = dump_documents(s.execute())
+    return compare_to_loops
+
 def get_compare_to_loops(request_info, function):
     compare_to_loops = {}
     if request_info.compare_to:
-        s = db.Function.search().\
-                               query('match', run_id=request_info.compare_to.meta.id).\
-                               query('match', function_name=function.function_name).\
-                               query('match', application=function.application).\
-                               query('match', filename=function.filename)
-        response = s.execute()
-        if response.success() and len(response):
-            compare_to_function = response[0]
-            s = db.Loop.search().query('match', function_id=compare_to_function.meta.id)
-            s = s[0:10000]
-            response_loops = s.execute()
-            for loop in response_loops:
-                compare_to_loops[loop.loop_id] = loop 
+        # Stored loop deltas depend on both runs.
+        loops = get_cached([request_info.current_run, request_info.compare_to],
+                           'compare_to_loops',
+                           {'application': function.application,
+                            'filename': function.filename,
+                            'function_name': function.function_name,
+                            'function_id': function.meta.id},
+                           lambda: find_compare_to_loops(request_info, function))
+        for loop in load_documents(loops):
+            compare_to_loops[loop.loop_id] = loop
     return compare_to_loops
 
-@frontend.route("/function/<id>")
-def function(id):
-    function = db.Function.get(id=id)
-    s = db.Loop.search().query('match', function_id=id)
+def find_function_loops(function_id):
+    s = db.Loop.search().query('match', function_id=function_id)
     s = s[0:10000]
-    loops = s.execute()
+    return dump_documents(s.execute())
 
+def get_function_loops(function_id):
+    """Get function, its run and loops. Denormalized loops are used if they
+    exist, so function is built from them with a single search. Otherwise
+    loops are taken from result cache."""
+    s = db.RunLoop.search().query('match', function_id=function_id)
+    s = s[0:10000]
+    loops = s.execute()
+    if len(loops):
+        function = loops[0].get_function()
+        return (function, db.Run.get(id=function.run_id), list(loops))
+    function = db.Function.get(id=function_id)
     run = db.Run.get(id=function.run_id)
+    loops = load_documents(get_cached([run], 'function_loops',
+                                      {'function_id': function_id},
+                                      lambda: find_function_loops(function_id)))
+    return (function, run, loops)
+
+@frontend.route("/function/<id>")
+def function(id):
+    function, run, loops = get_function_loops(id)
     request_info = CompareRequestInfo(run)
 
     compare_to_loops = get_compare_to_loops(request_info, function)
@@ -145,29 +214,22 @@ def function(id):
                                             compare_to_loops=compare_to_loops)
 
 def get_loop_features_set(loop):
+    if isinstance(loop, db.RunLoop):
+        return loop.get_features_sets()
     # Find loop features.
     s = db.LoopFeatures.search().query('match', block_id=loop.meta.id).sort('order')
     s = s[0:10000]
     loop_features = s.execute()
-
-    features_sets = {}
-    features_sets['Before'] = []
-    features_sets['After'] = []
-    previous_place = 'After'
-    for features in loop_features:
-        features_set = db.Features.get(id=features.features_id, ignore=404)
-        if features_set:
-            if features_set.place == previous_place:
-                del features_sets[features_set.place][-1]
-            features_sets[features_set.place].append(features_set)
-            previous_place = features_set.place
-    result_features = zip(features_sets['Before'], features_sets['After'])
-    return result_features
+    return db.get_features_sets(loop_features)
 
 @frontend.route("/loop/<id>")
 def loop(id):
-    loop = db.Loop.get(id=id)
-    function = db.Function.get(id=loop.function_id)
+    loop = db.RunLoop.get(id=id, ignore=404)
+    if loop:
+        function = loop.get_function()
+    else:
+        loop = db.Loop.get(id=id)
+        function = db.Function.get(id=loop.function_id)
     run = db.Run.get(id=function.run_id)
     request_info = CompareRequestInfo(run)
     runs_features_sets = []
@@ -177,28 +239,24 @@ def loop(id):
     if request_info.compare_to:
         if not request_info.compared_loop:
             # Find same loop.
-            
-            s = db.Function.search().\
-                                   query('match', run_id=request_info.compare_to.meta.id).\
-                                   query('match', function_name=function.function_name).\
-                                   query('match', application=function.application).\
-                                   query('match', filename=function.filename)
-            response = s.execute()
-            if response.success() and len(response):
-                compare_to_function = response[0]
-                s = db.Loop.search().query('match', function_id=compare_to_function.meta.id).\
-                                     query('match', loop_id=loop.loop_id)
-                                                    
-                response_loops = s.execute()
-                if len(response_loops) == 1:
-                    request_info.compared_loop = response_loops[0]
-        compared_loop_features = get_loop_features_set(request_info.compared_loop)
-        runs_features_sets = itertools.izip_longest(result_features, compared_loop_features)
+            compare_to_loops = get_compare_to_loops(request_info, function)
+            if loop.loop_id in compare_to_loops:
+                request_info.compared_loop = compare_to_loops[loop.loop_id]
+        if request_info.compared_loop:
+            compared_loop_features = get_loop_features_set(request_info.compared_loop)
+            runs_features_sets = itertools.izip_longest(result_features, compared_loop_features)
     return render_template("loop.html", loop=loop, 
                            features_sets=result_features,
                            request_info=request_info,
                            runs_features_sets=runs_features_sets)
 
+@frontend.route("/cache_stats")
+def cache_stats():
+    cache = getattr(current_app, 'result_cache', None)
+    if cache is None:
+        return flask.jsonify({})
+    return flask.jsonify(cache.stats())
+
 @frontend.route("/graph/<loop_id>/<run_id>")
 def graph(loop_id, run_id):
     loop = db.Loop.get(id=loop_id)
@@ -206,12 +264,7 @@ def graph(loop_id, run_id):
 
 @frontend.route("/loop_graph/<function_id>")
 def loop_graph(function_id):
-    function = db.Function.get(id=function_id)
-    s = db.Loop.search().query('match', function_id=function_id)
-    s = s[0:10000]
-    loops = s.execute()
-
-    run = db.Run.get(id=function.run_id)
+    function, run, loops = get_function_loops(function_id)
     request_info = CompareRequestInfo(run)
 
     compare_to_loops = get_compare_to_loops(request_info, function)
@@ -0,0 +1,125 @@
+"""
+Execution harness for profiled runs.
+
+Measured processes are bound to profiling CPUs (isolated CPUs by default)
+and state of machine is checked before every measurement. Frequency
+governors of profiling CPUs and load average are recorded, so that runs
+measured on noisy machine can be flagged or not measured at all.
+"""
+
+import glob
+import os
+
+ISOLATED_CPUS_FILE = '/sys/devices/system/cpu/isolated'
+GOVERNOR_FILE = '/sys/devices/system/cpu/cpu%d/cpufreq/scaling_governor'
+LOADAVG_FILE = '/proc/loadavg'
+
+NOISE_POLICIES = ('ignore', 'flag', 'refuse')
+
+class NoisyMachineError(RuntimeError):
+    """Machine state doesn't allow to measure."""
+
+def parse_cpu_list(cpus):
+    """Convert CPUs list in taskset/sysfs format (e.g. '0,2-3') to list of
+    numbers."""
+    result = []
+    for part in cpus.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, dash, last = part.partition('-')
+        if dash:
+            result.extend(range(int(first), int(last) + 1))
+        else:
+            result.append(int(first))
+    return result
+
+def _read_file(path):
+    try:
+        with open(path) as read_file:
+            return read_file.read().strip()
+    except IOError:
+        return None
+
+def isolated_cpus():
+    """Get CPUs isolated from scheduler (isolcpus) or None."""
+    return _read_file(ISOLATED_CPUS_FILE) or None
+
+def load_average():
+    """Get 1-minute load average or None if it is unknown."""
+    loadavg = _read_file(LOADAVG_FILE)
+    if not loadavg:
+        return None
+    return float(loadavg.split()[0])
+
+def governors(cpus=None):
+    """Get {cpu: governor} for CPUs, all CPUs are checked by default."""
+    if cpus is None:
+        paths = glob.glob(GOVERNOR_FILE.replace('%d', '*'))
+        cpus = sorted(int(path.split('/')[-3][len('cpu'):]) for path in paths)
+    result = {}
+    for cpu in cpus:
+        governor = _read_file(GOVERNOR_FILE % cpu)
+        if governor:
+            result[cpu] = governor
+    return result
+
+class ExecutionHarness(object):
+    """Binds measured commands to CPUs and checks machine noise."""
+
+    def __init__(self, cpus=None, max_load=None, noise_policy='flag'):
+        if noise_policy not in NOISE_POLICIES:
+            raise ValueError("unknown noise policy %r" % noise_policy)
+        if cpus is None:
+            cpus = isolated_cpus()
+        self.cpus = cpus
+        self.max_load = max_load
+        self.noise_policy = noise_policy
+        self.reset()
+
+    def reset(self):
+        """Forget state recorded by previous checks."""
+        self.noise = []
+        self.governors = set()
+        self.max_load_average = None
+
+    @property
+    def noisy(self):
+        return bool(self.noise)
+
+    def wrap(self, command):
+        """Bind command (list of arguments or shell string) to CPUs."""
+        if not self.cpus:
+            return command
+        if isinstance(command, basestring):
+            return 'taskset -c %s %s' % (self.cpus, command)
+        return ['taskset', '-c', self.cpus] + list(command)
+
+    def check(self):
+        """Record machine state before measurement.
+        Returns list of found noise reasons, NoisyMachineError is raised
+        for them if policy is 'refuse'."""
+        if self.noise_policy == 'ignore':
+            return []
+        reasons = []
+        cpus = parse_cpu_list(self.cpus) if self.cpus else None
+        for cpu, governor in sorted(governors(cpus).items()):
+            self.governors.add(governor)
+            if governor != 'performance':
+                reasons.append("cpu%d frequency governor is %s" % (cpu, governor))
+        load = load_average()
+        if load is not None:
+            self.max_load_average = max(load, self.max_load_average)
+            if self.max_load is not None and load > self.max_load:
+                reasons.append("load average %.2f is above %.2f" % (load, self.max_load))
+        if reasons and self.noise_policy == 'refuse':
+            raise NoisyMachineError("machine is noisy: " + "; ".join(reasons))
+        for reason in reasons:
+            if reason not in self.noise:
+                self.noise.append(reason)
+        return reasons
+
+    def prepare(self, command):
+        """Check machine and get command which should be executed."""
+        self.check()
+        return self.wrap(command)
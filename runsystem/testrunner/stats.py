@@ -0,0 +1,49 @@
+"""
+Statistics for repeated measurements.
+"""
+
+import math
+
+# Two-sided 95% quantiles of Student's t-distribution for 1..30 degrees
+# of freedom, normal quantile is used for more.
+T_95 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+Z_95 = 1.960
+
+def mean(values):
+    return float(sum(values)) / len(values)
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return float(ordered[middle])
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+def stddev(values):
+    """Sample standard deviation."""
+    if len(values) < 2:
+        return 0.0
+    values_mean = mean(values)
+    return math.sqrt(sum((value - values_mean) ** 2 for value in values) /
+                     (len(values) - 1))
+
+def relative_ci(values):
+    """Half-width of 95% confidence interval of mean relative to mean.
+    Returns None if it can't be estimated."""
+    if len(values) < 2:
+        return None
+    values_mean = mean(values)
+    if values_mean == 0:
+        return None
+    degrees = len(values) - 1
+    quantile = T_95[degrees - 1] if degrees <= len(T_95) else Z_95
+    return quantile * stddev(values) / math.sqrt(len(values)) / abs(values_mean)
+
+def summarize(values):
+    """Get dict with mean, median, min and stddev of values."""
+    return {'mean': mean(values),
+            'median': median(values),
+            'min': float(min(values)),
+            'stddev': stddev(values)}
@@ -14,8 +14,17 @@ import multiprocessing
 import getpass
 import traceback
 import datetime
+import time
+import hashlib
+import itertools
+from multiprocessing.pool import ThreadPool
 
 import runsystem.db.data as data
+import runsystem.db.ingest as ingest
+import runsystem.db.columnar as columnar
+import runsystem.testrunner.stats as stats
+import runsystem.testrunner.harness as harness
+import runsystem.profilers as profilers
 
 from optparse import OptionParser, OptionGroup
 
@@ -29,25 +38,78 @@ class Profiler(object):
         self._run_line = None
         self._path = None
         self._application = None
+        # ExecutionHarness for measured commands.
+        self.harness = None
 
-    def run(self, args):
+    def measure(self, args):
+        """Execute application under profiler and collect raw profile data."""
         raise RuntimeError("Abstract Method.")
 
-    def _run(self, log, run_line, profiler_path, application,
-             offset_files, args):
+    def analyze(self, args, offset_files):
+        """Process collected profile data and return metrics for loops."""
+        raise RuntimeError("Abstract Method.")
+
+    def parse(self, args, offset_files):
+        """Get metrics for loops from profile data saved by previous
+        analyze() call."""
+        raise RuntimeError("Abstract Method.")
+
+    def run(self, args, offset_files):
+        self.measure(args)
+        return self.analyze(args, offset_files)
+
+    def _setup(self, log, run_line, profiler_path, application):
         self._log = log
         self._run_line = run_line
         self._path = profiler_path
         self._application = application
+
+    def _teardown(self):
+        self._log = None
+        self._run_line = None
+        self._path = None
+        self._application = None
+
+    def _run(self, log, run_line, profiler_path, application,
+             offset_files, args):
+        self._setup(log, run_line, profiler_path, application)
         try:
             return self.run(args, offset_files)
         finally:
-            self._log = None
-            self._run_line = None
-            self._path = None
-            self._application = None
+            self._teardown()
+
+    def _measure(self, log, run_line, profiler_path, application, args):
+        self._setup(log, run_line, profiler_path, application)
+        try:
+            return self.measure(args)
+        finally:
+            self._teardown()
+
+    def _analyze(self, log, run_line, profiler_path, application,
+                 offset_files, args):
+        self._setup(log, run_line, profiler_path, application)
+        try:
+            return self.analyze(args, offset_files)
+        finally:
+            self._teardown()
+
+    def _parse(self, log, run_line, profiler_path, application,
+               offset_files, args):
+        self._setup(log, run_line, profiler_path, application)
+        try:
+            return self.parse(args, offset_files)
+        finally:
+            self._teardown()
+
+    def _prepare_command(self, command):
+        """Check machine state and bind measured command to profiling
+        CPUs."""
+        if self.harness is None:
+            return command
+        return self.harness.prepare(command)
 
     def call(self, args, **kwargs):
+        args = self._prepare_command(args)
         if kwargs.get('shell', False):
             cmdstr = args
         else:
@@ -113,8 +175,6 @@ note = lambda message: getLogger().info(message)
 warning = lambda message: getLogger().warning(message)
 error = lambda message: getLogger().error(message)
 
-data.init_database()
-
 def resolve_command_path(name):
     """Try to make the name/path given into an absolute path to an
     executable.
@@ -142,6 +202,14 @@ def isexecfile(path):
 def timestamp():
     return datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
 
+def hash_file(path):
+    """Get SHA1 digest of file content."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as hashed_file:
+        for chunk in iter(lambda: hashed_file.read(1024 * 1024), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 def mkdir_p(path):
     """mkdir_p(path) - Make the "path" directory, if it does not exist; this
     will also make directories for any missing parent directories."""
@@ -156,7 +224,17 @@ def mkdir_p(path):
 
 class TestRunner(object):
     def __init__(self):
-        self._runs = (None, None)
+        # Baseline run followed by runs with ML options.
+        self._runs = []
+        self._harness = None
+        self._ingest = None
+        self._pool = None
+        self._columnar = None
+        # Measurements refused on noisy machine.
+        self._skipped = []
+        # Profiler instances by name.
+        self._profiler_instances = {}
+        self._build_key = None
 
     def describe(self):
         return "LLVM test-suite"
@@ -167,6 +245,11 @@ class TestRunner(object):
         group.add_option("-S", "--sandbox", dest="sandbox_path",
                          help="Parent directory to build and run tests in",
                          type=str, default=None, metavar="PATH")
+        group.add_option("", "--build-cache", dest="build_cache",
+                         help="Directory with builds reused by runs with the "
+                              "same compilers and flags, only changed "
+                              "executables are rebuilt and profiled again",
+                         type=str, default=None, metavar="PATH")
         parser.add_option_group(group)
         
         group = OptionGroup(parser, "Inputs")
@@ -211,6 +294,47 @@ class TestRunner(object):
         group.add_option("-j", "--threads", dest="threads",
                          help="Number of testing (and optionally build) "
                          "threads", type=int, default=1, metavar="N")
+        group.add_option("", "--build-threads", dest="build_threads",
+                         help="Number of configurations built in parallel",
+                         type=int, default=1, metavar="N")
+        group.add_option("", "--profile-cpus", dest="profile_cpus",
+                         help="CPUs which profiled executables are bound to, "
+                              "in taskset format (e.g. 2,3 or 4-7), isolated "
+                              "CPUs are used by default",
+                         type=str, default=None, metavar="LIST")
+        group.add_option("", "--max-load", dest="max_load",
+                         help="Load average above which machine is "
+                              "considered noisy",
+                         type=float, default=None, metavar="LOAD")
+        group.add_option("", "--noise-policy", dest="noise_policy",
+                         type='choice', choices=list(harness.NOISE_POLICIES),
+                         default='flag',
+                         help="What to do if machine is noisy before "
+                              "measurement: ignore, flag run or refuse to "
+                              "measure [%default]")
+        group.add_option("", "--noise-retries", dest="noise_retries",
+                         help="Number of retries of measurement refused on "
+                              "noisy machine, executable is skipped after "
+                              "them [%default]",
+                         type=int, default=3, metavar="N")
+        group.add_option("", "--noise-backoff", dest="noise_backoff",
+                         help="Seconds to wait before retry of refused "
+                              "measurement, doubled for each retry [%default]",
+                         type=int, default=30, metavar="SECONDS")
+        group.add_option("", "--repeat", dest="repeat",
+                         help="Maximum number of measurements of each "
+                              "executable [%default]",
+                         type=int, default=1, metavar="N")
+        group.add_option("", "--repeat-ci", dest="repeat_ci",
+                         help="Stop measurements of executable when 95%% "
+                              "confidence interval of its run time is "
+                              "within given fraction of mean (e.g. 0.02)",
+                         type=float, default=None, metavar="FRACTION")
+        group.add_option("", "--repeat-interleave", dest="repeat_interleave",
+                         help="Measure all configurations before the next "
+                              "repetition, so that changes of machine state "
+                              "affect them equally",
+                         action="store_true", default=False)
         parser.add_option_group(group)
         group = OptionGroup(parser, "Output Options")
         group.add_option("", "--submit", dest="submit_url", metavar="URLORPATH",
@@ -220,9 +344,18 @@ class TestRunner(object):
         group.add_option("", "--run-options", dest="run_options", type=str, metavar="[Optimization Options]",
                          default = "-O3",
                          help="Optimization options for run tests")
-        group.add_option("", "--ml-options", dest="mloptions", 
-                         type=str, metavar="[ML Options]", default=None,
-                         help="Combinations of options to turn on/off")
+        group.add_option("", "--ml-options", dest="mloptions", action="append",
+                         type=str, metavar="[ML Options]", default=[],
+                         help="Combinations of options to turn on/off. Can be "
+                              "given multiple times, each one is run and "
+                              "compared with the same baseline")
+        group.add_option("", "--ml-options-grid", dest="mloptions_grid",
+                         action="append", type=str, default=[],
+                         metavar="[ML Options|ML Options...]",
+                         help="Alternatives of options separated by '|'. Can "
+                              "be given multiple times, all combinations of "
+                              "alternatives are run")
+        self._add_ingest_options(group)
         parser.add_option_group(group)
 
         group = OptionGroup(parser, "Test tools")
@@ -250,6 +383,18 @@ class TestRunner(object):
         if self.opts.cc is None:
             parser.error('--cc is required')
 
+        if self.opts.repeat < 1:
+            parser.error('--repeat should be positive')
+
+        if self.opts.columnar_store and not columnar.available():
+            parser.error('--columnar-store requires numpy')
+
+        self._harness = harness.ExecutionHarness(opts.profile_cpus,
+                                                 opts.max_load,
+                                                 opts.noise_policy)
+        if self._harness.cpus:
+            note("Profiled executables are bound to CPUs %s" % self._harness.cpus)
+
         # Option validation.
         opts.cc = resolve_command_path(opts.cc)
 
@@ -269,7 +414,7 @@ class TestRunner(object):
         opts.cmake = resolve_command_path(opts.cmake)
         if not isexecfile(opts.cmake):
             parser.error("CMake tool not found (looked for %s)" % opts.cmake)
-        profilers_modules = list(self._scan_for_profilers())
+        profilers_modules = profilers.get_profiler_names()
         if opts.profiler not in profilers_modules:
             parser.error("Module for profiler %s not found" % opts.profiler)
         if opts.profiler_path:
@@ -307,7 +452,264 @@ class TestRunner(object):
 
         self.run_in_dirs()
 
+    def _add_ingest_options(self, group):
+        """Add options of saving results to database."""
+        group.add_option("", "--bulk-size", dest="bulk_size", type=int,
+                         default=500, metavar="N",
+                         help="Number of documents in one database bulk "
+                              "request [%default]")
+        group.add_option("", "--bulk-bytes", dest="bulk_bytes", type=int,
+                         default=100 * 1024 * 1024, metavar="N",
+                         help="Maximum size of one database bulk request "
+                              "in bytes [%default]")
+        group.add_option("", "--denormalize", dest="denormalize", default=False,
+                         action="store_true",
+                         help="Also save loops with embedded function, run "
+                              "and features for faster pages")
+        group.add_option("", "--ingest-queue", dest="ingest_queue", type=int,
+                         default=8, metavar="N",
+                         help="Number of bulk requests waiting for database "
+                              "while next tests are profiled [%default]")
+        group.add_option("", "--ingest-timeout", dest="ingest_timeout",
+                         type=int, default=600, metavar="SECONDS",
+                         help="Time to wait for database before documents "
+                              "are written to ingest journal [%default]")
+        group.add_option("", "--ingest-journal", dest="ingest_journal",
+                         type=str, default=None, metavar="PATH",
+                         help="File for documents which database doesn't "
+                              "accept (ingest.journal in sandbox run "
+                              "directory by default)")
+        group.add_option("", "--columnar-store", dest="columnar_store",
+                         type=str, default=None, metavar="PATH",
+                         help="Also save loops and features of runs as "
+                              "NumPy arrays in given directory")
+
+    def replay_test(self, name, args):
+        """Parse profiles stored in sandbox of previous run again and save
+        them as new runs."""
+        parser = OptionParser("%s [options] sandbox" % name)
+        group = OptionGroup(parser, "Test Execution")
+        group.add_option("-j", "--threads", dest="threads",
+                         help="Number of parsing processes", type=int,
+                         default=1, metavar="N")
+        parser.add_option_group(group)
+        group = OptionGroup(parser, "Output Options")
+        self._add_ingest_options(group)
+        parser.add_option_group(group)
+        group = OptionGroup(parser, "Test tools")
+        group.add_option("", "--use-profiler", dest="profiler",
+                         type=str, default=None,
+                         help="Module with profiler which parses profiles "
+                              "(profiler of replayed run by default)")
+        group.add_option("", "--profiler-path", dest="profiler_path", metavar="PATH",
+                         type=str, default="",
+                         help="Path to used profiler")
+        parser.add_option_group(group)
+
+        (opts, args) = parser.parse_args(args)
+        if len(args) != 1:
+            parser.error("invalid number of arguments")
+        self.opts = opts
+        self.opts.build_cache = None
+        if opts.columnar_store and not columnar.available():
+            parser.error('--columnar-store requires numpy')
+
+        sandbox, = args
+        if not os.path.isdir(sandbox):
+            parser.error("invalid sandbox argument, does not exist: %r" % sandbox)
+        manifests = self._find_manifests(sandbox)
+        if not manifests:
+            parser.error("no run manifests found in %r" % sandbox)
+        profilers_modules = profilers.get_profiler_names()
+        for manifest in manifests:
+            profiler = opts.profiler or manifest['profiler']
+            if profiler not in profilers_modules:
+                parser.error("Module for profiler %s not found" % profiler)
+
+        self._base_path = sandbox
+        self.replay_in_dirs(manifests)
+
+    def replay_in_dirs(self, manifests):
+        data.init_database()
+        self._start_pool()
+        try:
+            self._start_ingest()
+            try:
+                self._replay_manifests(manifests)
+            finally:
+                self._finish_ingest()
+        finally:
+            self._stop_pool()
+
+    def _replay_manifests(self, manifests):
+        replay_profiler = self.opts.profiler
+        # Configurations of each sandbox run are connected separately.
+        for date_time, session in itertools.groupby(
+                manifests, key=lambda manifest: manifest['date_time']):
+            self._runs = []
+            for manifest in session:
+                self.ts = manifest['date_time']
+                self.args = manifest['profiler_args']
+                self.opts.profiler = replay_profiler or manifest['profiler']
+                profile_path = manifest.get('profile_path') or manifest['build_path']
+                self._run_tests(profile_path, manifest['options'],
+                                self._find_profiles(profile_path))
+                # Machine state can't be recorded again, take it from manifest.
+                run = self._runs[-1]
+                for field, value in manifest['machine_state'].iteritems():
+                    setattr(run, field, value)
+                self._save_document(run)
+            self._connect_runs()
+            self._compute_loop_deltas()
+
+    def _find_manifests(self, sandbox):
+        """Find manifests of configurations in sandbox, they are ordered by
+        sandbox run and baseline goes first. Manifests are inferred from
+        directories layout for sandboxes made without them."""
+        manifests = []
+        for dirpath, dirnames, filenames in os.walk(sandbox):
+            if MANIFEST_NAME in filenames:
+                with open(os.path.join(dirpath, MANIFEST_NAME)) as manifest_file:
+                    manifests.append(json.load(manifest_file))
+        if not manifests:
+            manifests = self._infer_manifests(sandbox)
+            if manifests:
+                note("No run manifests in %s, configurations are inferred "
+                     "from build directories" % sandbox)
+        manifests.sort(key=lambda manifest: (manifest['date_time'],
+                                             manifest['order']))
+        return manifests
+
+    def _infer_manifests(self, sandbox):
+        """Make manifests for sandbox layout run-<ts>/<options>/default and
+        run-<ts>/<options>/<ml options>, where configuration directories
+        are build directories. Options are taken from CMake cache."""
+        manifests = []
+        for dirpath, dirnames, filenames in os.walk(sandbox):
+            if 'default' not in dirnames or \
+                    not os.path.isfile(os.path.join(dirpath, 'default',
+                                                    'CMakeCache.txt')):
+                continue
+            # Configurations aren't searched inside build directories.
+            configs = sorted(dirnames, key=lambda name: (name != 'default', name))
+            dirnames[:] = []
+            run_dir = os.path.basename(os.path.dirname(os.path.abspath(dirpath)))
+            if run_dir.startswith('run-'):
+                date_time = run_dir[len('run-'):]
+            else:
+                date_time = time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime(
+                        os.path.getmtime(dirpath)))
+            order = 0
+            for config in configs:
+                build_path = os.path.join(dirpath, config)
+                options = self._get_configured_options(build_path)
+                if options is None:
+                    continue
+                if not options:
+                    # Options are in directory names.
+                    options = os.path.basename(dirpath).replace('_', ' ')
+                    if config != 'default':
+                        options += ' ' + config.replace('_', ' ')
+                manifests.append({'date_time': date_time,
+                                  'options': options,
+                                  'order': order,
+                                  'build_path': os.path.abspath(build_path),
+                                  'profiler': 'oprofile',
+                                  'profiler_args': [],
+                                  'run_id': None,
+                                  'profile_path': None,
+                                  'machine_state': {}})
+                order += 1
+        return manifests
+
+    def _get_configured_options(self, build_path):
+        """Get options of run from CMake cache of build directory.
+        Returns None if directory isn't configured, empty string if options
+        aren't found."""
+        cache_file = os.path.join(build_path, 'CMakeCache.txt')
+        if not os.path.isfile(cache_file):
+            return None
+        with open(cache_file) as cache:
+            for line in cache:
+                if line.startswith('CMAKE_C_FLAGS:'):
+                    flags = line.partition('=')[2]
+                    if FEATURES_FLAGS in flags:
+                        return flags.partition(FEATURES_FLAGS)[0].strip()
+        return ''
+
+    def _find_profiles(self, build_path):
+        """Find log files of stored profiles in build directory.
+        Returns {(dirpath, filename): (None, log_files, True)}."""
+        profiles = {}
+        for dirpath, filename, run_line in self._collect_tests(build_path):
+            log_files = []
+            while os.path.isfile(self._get_log_file(dirpath, filename,
+                                                    len(log_files))):
+                log_files.append(self._get_log_file(dirpath, filename,
+                                                    len(log_files)))
+            if log_files:
+                profiles[(dirpath, filename)] = (None, log_files, True)
+            else:
+                warning("no stored profile for %s" % filename)
+        return profiles
+
+    def _save_profiles(self, build_path, config_path):
+        """Copy profiles of the last run and files they are parsed with to
+        configuration directory, so that run can be replayed after shared
+        build directory is used by other runs. Returns path of copy."""
+        profiles_path = os.path.join(config_path, PROFILES_DIR)
+        if os.path.exists(profiles_path):
+            shutil.rmtree(profiles_path)
+        for dirpath, filename, log_files in self._run_profiles:
+            target = os.path.join(profiles_path,
+                                  os.path.relpath(dirpath, build_path))
+            mkdir_p(target)
+            bindings_file = os.path.join(dirpath, filename + ".bindings")
+            paths = [os.path.join(dirpath, filename),
+                     os.path.join(dirpath, filename + ".test"),
+                     bindings_file] + log_files
+            for bind_file in self._get_bindings(bindings_file):
+                paths.append(os.path.join(dirpath, bind_file + ".functions.offset"))
+                paths.append(os.path.join(dirpath, bind_file + ".features.output"))
+            for path in paths:
+                if os.path.isfile(path):
+                    shutil.copy2(path, target)
+        return os.path.abspath(profiles_path)
+
+    def _write_manifest(self, config_path, build_path, options, order,
+                        profile_path=None):
+        """Save description of configuration run, which is used to replay
+        it. profile_path is directory with copy of profiles if they aren't
+        kept in build directory."""
+        run = self._runs[-1]
+        run_fields = run.to_dict()
+        manifest = {'date_time': self.ts,
+                    'options': options,
+                    'order': order,
+                    'build_path': os.path.abspath(build_path),
+                    'profiler': self.opts.profiler,
+                    'profiler_args': self.args,
+                    'run_id': run.meta.id,
+                    'profile_path': profile_path,
+                    'machine_state': dict((field, run_fields.get(field))
+                                          for field in MACHINE_STATE_FIELDS)}
+        with open(os.path.join(config_path, MANIFEST_NAME), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
     def run_in_dirs(self):
+        data.init_database()
+        mkdir_p(self._base_path)
+        self._start_pool()
+        try:
+            self._start_ingest()
+            try:
+                self._run_configs()
+            finally:
+                self._finish_ingest()
+        finally:
+            self._stop_pool()
+
+    def _run_configs(self):
         path = self._base_path
         
         if not os.path.exists(path):
@@ -317,27 +719,320 @@ class TestRunner(object):
         # Create folder for each run optimize option.    
         path = os.path.join(self._base_path, opt_run_options.replace(' ', '_'))
         mkdir_p(path)
-        path_default = os.path.join(path, "default")
-        mkdir_p(path_default)
-        self.run(path_default, opt_run_options)
-
-        if self.opts.mloptions:
-            path_mlopt = os.path.join(path, self.opts.mloptions.replace(' ', '_'))
-            mkdir_p(path_mlopt)
-            self.run(path_mlopt, opt_run_options, self.opts.mloptions)
-        # If compared runs used, connect two runs.
-        if self._runs[0] and self._runs[1]:
-            self._runs[0].connected_run_id = self._runs[1].meta.id
-            self._runs[1].connected_run_id = self._runs[0].meta.id
-            self._runs[0].save()
-            self._runs[1].save()
+        configs = [(os.path.join(path, "default"), "")]
+        for mloptions in self._get_ml_options():
+            configs.append((os.path.join(path, mloptions.replace(' ', '_')),
+                            mloptions))
+        for config_path, mloptions in configs:
+            mkdir_p(config_path)
+
+        # Configurations are built in parallel, but profiled one by one.
+        builds = self._build_configs(configs, opt_run_options)
+        measured = [None] * len(builds)
+        if self.opts.repeat_interleave:
+            # Machine state is recorded for all runs together.
+            self._reset_harness()
+            measured = self._profile_interleaved(builds)
+        for order, ((config_path, mloptions), (build_path, build_key), config_measured) in \
+                enumerate(zip(configs, builds, measured)):
+            if not self.opts.repeat_interleave:
+                self._reset_harness()
+            self._build_key = build_key
+            print(build_path)
+            options = ' '.join((opt_run_options, mloptions)).rstrip()
+            self._run_tests(build_path, options, config_measured)
+            profile_path = None
+            if build_path != config_path:
+                # Build directory is shared with other runs.
+                profile_path = self._save_profiles(build_path, config_path)
+            self._write_manifest(config_path, build_path, options, order,
+                                 profile_path)
+        self._connect_runs()
+        self._compute_loop_deltas()
+
+    def _get_ml_options(self):
+        """Get list of ML options from --ml-options and all combinations
+        of --ml-options-grid alternatives."""
+        variants = list(self.opts.mloptions)
+        if self.opts.mloptions_grid:
+            alternatives = [grid.split('|') for grid in self.opts.mloptions_grid]
+            for combination in itertools.product(*alternatives):
+                variants.append(' '.join(option.strip() for option in combination))
+        result = []
+        for variant in variants:
+            variant = ' '.join(variant.split())
+            if variant and variant not in result:
+                result.append(variant)
+        return result
+
+    def _build_configs(self, configs, opt_option):
+        """Build list of (path, mloptions) configurations.
+        Returns list of (build_path, build_key)."""
+        build = lambda config: self._build(config[0], opt_option, config[1])
+        threads = min(self.opts.build_threads, len(configs))
+        if threads <= 1:
+            return map(build, configs)
+        pool = ThreadPool(threads)
+        try:
+            return pool.map(build, configs)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _connect_runs(self):
+        """Connect runs with ML options to baseline run. Baseline is
+        connected back only if it is compared with one run."""
+        baseline = self._runs[0]
+        variants = self._runs[1:]
+        for variant in variants:
+            variant.connected_run_id = baseline.meta.id
+            self._save_document(variant)
+            self._connect_columnar_run(variant)
+        if len(variants) == 1:
+            baseline.connected_run_id = variants[0].meta.id
+            self._save_document(baseline)
+            self._connect_columnar_run(baseline)
+
+    def _start_pool(self):
+        """Start pool of post-processing workers, which is used for all
+        configurations. Workers are forked before ingest thread is started,
+        so they can't inherit locks held by it."""
+        self._pool = None
+        if self.opts.threads > 1:
+            self._pool = multiprocessing.Pool(self.opts.threads,
+                                              initializer=_init_worker,
+                                              initargs=(self,))
+
+    def _stop_pool(self):
+        pool, self._pool = self._pool, None
+        if pool:
+            pool.terminate()
+            pool.join()
+
+    def _start_ingest(self):
+        """Start background writer of documents to database."""
+        journal = self.opts.ingest_journal or os.path.join(self._base_path,
+                                                           "ingest.journal")
+        self._ingest = ingest.IngestQueue(journal, self.opts.ingest_queue,
+                                          self.opts.ingest_timeout)
+
+    def _finish_ingest(self):
+        """Wait for queued documents and stop background writer."""
+        queue, self._ingest = self._ingest, None
+        queue.close()
+        if queue.spooled:
+            warning("%d documents weren't written to database and are saved "
+                    "to %s, load them with 'runsystem ingest-journal %s'" % (
+                        queue.spooled, queue.journal_path, queue.journal_path))
+
+    def _compute_loop_deltas(self):
+        """Match loops of connected runs once and save their deltas, so
+        comparisons read them directly."""
+        self._ingest.refresh()
+        if self._ingest.spooling:
+            warning("loop deltas aren't computed, run 'runsystem "
+                    "compute-loop-deltas' after loading ingest journal")
+            return
+        writer = data.BulkWriter(batch_size=self.opts.bulk_size,
+                                 max_bytes=self.opts.bulk_bytes,
+                                 queue=self._ingest)
+        for run in self._runs:
+            if run.connected_run_id:
+                matched = data.compute_loop_deltas(writer, run.meta.id,
+                                                   run.connected_run_id,
+                                                   self.opts.bulk_size)
+                note("%d loops of run %s are matched with run %s" % (
+                        matched, run.meta.id, run.connected_run_id))
+
+    def _connect_columnar_run(self, run):
+        if self.opts.columnar_store:
+            columnar.set_connected_run(self.opts.columnar_store, run.meta.id,
+                                       run.connected_run_id)
+
+    def _save_document(self, document):
+        """Save document to database after queued documents."""
+        writer = data.BulkWriter(queue=self._ingest)
+        writer.add(document)
+        writer.flush()
+
+    def _reset_harness(self):
+        self._skipped = []
+        if self._harness:
+            self._harness.reset()
 
     def run(self, path, opt_option, mloptions = ""):
-        self._configure(path, opt_option, mloptions)
-        self._clean(path)
-        self._make(path)
+        self._reset_harness()
+        path, self._build_key = self._build(path, opt_option, mloptions)
         print(path)
-        self._run_tests(path, ' '.join((opt_option, mloptions)).rstrip())
+        options = ' '.join((opt_option, mloptions)).rstrip()
+        self._run_tests(path, options)
+        self._write_manifest(path, path, options, len(self._runs) - 1)
+
+    def _build(self, path, opt_option, mloptions):
+        """Build configuration. Returns (build_path, build_key), build key
+        is None if build cache isn't used."""
+        build_key = None
+        if self.opts.build_cache:
+            path, build_key = self._get_cached_build(opt_option, mloptions)
+        else:
+            self._configure(path, opt_option, mloptions)
+            self._clean(path)
+        self._make(path)
+        return (path, build_key)
+
+    def _get_build_key(self, opt_option, mloptions):
+        """Key of build configuration made of compilers content and all
+        flags. Changes of sources are handled by make itself."""
+        key = hashlib.sha1()
+        for compiler in (self.opts.cc, self.opts.cxx):
+            if os.path.isfile(compiler):
+                key.update(hash_file(compiler))
+            else:
+                key.update(compiler)
+        for flags in (os.path.abspath(self.opts.test_suite_root), opt_option,
+                      mloptions, self.opts.cppflags, self.opts.cflags,
+                      self.opts.cxxflags):
+            key.update('\0' + flags)
+        return key.hexdigest()
+
+    def _get_cached_build(self, opt_option, mloptions):
+        """Get build directory from build cache. Directory is configured
+        only once, later runs make it incrementally.
+        Returns (build_path, build_key)."""
+        build_key = self._get_build_key(opt_option, mloptions)
+        path = os.path.join(self.opts.build_cache, build_key)
+        if os.path.exists(os.path.join(path, 'CMakeCache.txt')):
+            note("Reusing build directory %s" % path)
+        else:
+            mkdir_p(path)
+            self._configure(path, opt_option, mloptions)
+        return (path, build_key)
+
+    def _get_profile_key(self, dirpath, filename, run_line):
+        """Key of profile data for executable from cached build."""
+        key = hashlib.sha1()
+        for part in (self._build_key, hash_file(os.path.join(dirpath, filename)),
+                     run_line, self.opts.profiler, ' '.join(self.args),
+                     str(self.opts.repeat), str(self.opts.repeat_ci)):
+            key.update(part + '\0')
+        return key.hexdigest()
+
+    def _get_profile_stamp(self, dirpath, filename):
+        return os.path.join(dirpath, filename + ".profile.stamp")
+
+    def _get_cached_profile(self, dirpath, filename, profile_key):
+        """Get log files of saved profile with given key.
+        Returns None if there is no such profile."""
+        stamp_file = self._get_profile_stamp(dirpath, filename)
+        if not os.path.isfile(stamp_file):
+            return None
+        with open(stamp_file) as stamp:
+            lines = stamp.read().split()
+        if not lines or lines[0] != profile_key:
+            return None
+        repetitions = int(lines[1]) if len(lines) > 1 else 1
+        log_files = [self._get_log_file(dirpath, filename, repetition)
+                     for repetition in range(repetitions)]
+        if not all(os.path.isfile(log_file) for log_file in log_files):
+            return None
+        return log_files
+
+    def _prepare_test(self, dirpath, filename, run_line):
+        """Check build cache for profile of executable.
+        Returns (profile_key, log_files), log_files is None if executable
+        should be measured."""
+        if not self._build_key:
+            return (None, None)
+        profile_key = self._get_profile_key(dirpath, filename, run_line)
+        return (profile_key, self._get_cached_profile(dirpath, filename,
+                                                      profile_key))
+
+    def _get_log_file(self, dirpath, filename, repetition):
+        if repetition == 0:
+            return os.path.join(dirpath, filename + ".asm.oprof")
+        return os.path.join(dirpath, "%s.%d.asm.oprof" % (filename, repetition))
+
+    def _is_stable(self, times):
+        """Check if measurements of executable can be stopped."""
+        if self.opts.repeat_ci is None or len(times) < MIN_REPEAT:
+            return False
+        ci = stats.relative_ci(times)
+        return ci is not None and ci <= self.opts.repeat_ci
+
+    def _measure_repetition(self, dirpath, filename, run_line, repetition):
+        """Measure executable once, measurement refused on noisy machine is
+        retried with backoff. Returns elapsed time, NoisyMachineError is
+        raised if machine is still noisy after retries."""
+        backoff = self.opts.noise_backoff
+        for retry in range(self.opts.noise_retries + 1):
+            try:
+                start = time.time()
+                self._measure(self._get_log_file(dirpath, filename, repetition),
+                              run_line, filename)
+                return time.time() - start
+            except harness.NoisyMachineError as e:
+                if retry == self.opts.noise_retries:
+                    raise
+                warning("%s, measurement of %s is retried in %d seconds" % (
+                        e, filename, backoff))
+                time.sleep(backoff)
+                backoff *= 2
+
+    def _skip_noisy(self, filename, error):
+        warning("%s is skipped: %s" % (filename, error))
+        self._skipped.append("skipped %s: %s" % (filename, error))
+
+    def _profile_test(self, dirpath, filename, run_line):
+        """Measure executable up to --repeat times, measurements are
+        stopped earlier if they are stable. Returns list of log files,
+        which is empty if executable is skipped on noisy machine."""
+        times = []
+        while len(times) < self.opts.repeat and not self._is_stable(times):
+            try:
+                times.append(self._measure_repetition(dirpath, filename,
+                                                      run_line, len(times)))
+            except harness.NoisyMachineError as e:
+                # Finished repetitions are still used.
+                self._skip_noisy(filename, e)
+                break
+        return [self._get_log_file(dirpath, filename, repetition)
+                for repetition in range(len(times))]
+
+    def _profile_interleaved(self, builds):
+        """Measure executables of all builds, each repetition is done for
+        all configurations before the next one.
+        Returns list of {(dirpath, filename): (profile_key, log_files, reuse)}
+        for builds."""
+        measured = []
+        pending = []
+        for build_path, build_key in builds:
+            self._build_key = build_key
+            config_measured = {}
+            for dirpath, filename, run_line in self._collect_tests(build_path):
+                profile_key, log_files = self._prepare_test(dirpath, filename,
+                                                            run_line)
+                config_measured[(dirpath, filename)] = (profile_key, log_files, True)
+                if log_files is None:
+                    pending.append((config_measured, profile_key, dirpath,
+                                    filename, run_line, []))
+            measured.append(config_measured)
+        for repetition in range(self.opts.repeat):
+            for config_measured, profile_key, dirpath, filename, run_line, times in pending:
+                if len(times) == repetition and not self._is_stable(times):
+                    try:
+                        times.append(self._measure_repetition(
+                                dirpath, filename, run_line, repetition))
+                    except harness.NoisyMachineError as e:
+                        self._skip_noisy(filename, e)
+        for config_measured, profile_key, dirpath, filename, run_line, times in pending:
+            if not times:
+                # Skipped on noisy machine.
+                del config_measured[(dirpath, filename)]
+                continue
+            log_files = [self._get_log_file(dirpath, filename, repetition)
+                         for repetition in range(len(times))]
+            config_measured[(dirpath, filename)] = (profile_key, log_files, False)
+        return measured
 
     def _unix_quote_args(self, s):
         return ' '.join(map(pipes.quote, shlex.split(s)))
@@ -434,27 +1129,6 @@ class TestRunner(object):
             pass
         return json.loads(open(output_json_path.name).read())
 
-    def _scan_for_profilers(self):
-        base_profiler_modules_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../profilers')
-
-        # We follow links here because we want to support the ability for having
-        # various "suites" of LNTBased tests in separate repositories, and allowing
-        # users to just checkout them out elsewhere and link them into their LLVM
-        # test-suite source tree.
-        profilers = []
-        for dirpath,dirnames,filenames in os.walk(base_profiler_modules_path,
-                                                  followlinks = True):
-            # Check if this directory defines a test module.
-            if 'profiler.py' not in filenames:
-                continue
-
-            # If so, don't traverse any lower.
-            del dirnames[:]
-
-            # Add to the list of test modules.
-            assert dirpath.startswith(base_profiler_modules_path + '/')
-            yield dirpath[len(base_profiler_modules_path) + 1:]
-
     def _extract_run_line(self, test_file):
         """ Get run line from test file generated by cmake """
         if os.path.isfile(test_file):
@@ -477,13 +1151,9 @@ class TestRunner(object):
                         result.append(filename)
         return result
 
-    def _run_tests(self, path, options):
-        run = data.Run(date_time=self.ts, options=options)
-        run.save()
-        if not self._runs[0]:
-            self._runs = (run, None)
-        else:
-            self._runs = (self._runs[0], run)
+    def _collect_tests(self, path):
+        """Find executables with run lines in build directory.
+        Yields (dirpath, filename, run_line)."""
         for dirpath,dirnames,filenames in os.walk(path,
                                                   followlinks = True):
             if 'CMakeFiles' in dirnames:
@@ -493,115 +1163,305 @@ class TestRunner(object):
                 if isexecfile(os.path.join(dirpath, filename)):
                     test_file = os.path.join(dirpath, filename + ".test")
                     run_line = self._extract_run_line(test_file)
-
-                    # Parse bindings.
-                    bindings_file = os.path.join(dirpath, filename + ".bindings")
-                    bind_filenames = self._get_bindings(bindings_file)
-                    offset_files = []
-                    features_output_files = []
-                    
-                    for bind_file in bind_filenames:
-                        offset_file = os.path.join(dirpath, bind_file + ".functions.offset")
-                        features_output_file = os.path.join(dirpath, bind_file + ".features.output")
-                        if os.path.isfile(offset_file):
-                            offset_files.append(offset_file)
-                        if os.path.isfile(features_output_file):
-                            features_output_files.append(features_output_file)
                     if run_line:
-                        #code_size_results = LoopCodeSizeCounter().run(offset_files, filename)
-                        #print(code_size_results)
-                        log_file = os.path.join(dirpath, filename + ".asm.oprof")
-                        metrics_results = self._profile(log_file, run_line, filename, offset_files)
-                        #print(metrics_results)
-                        features = self._parse_features_output(features_output_files)
-                        self.save_results(run, features, metrics_results)
-
+                        yield (dirpath, filename, run_line)
+
+    def _run_tests(self, path, options, measured=None):
+        """Profile executables in build directory and save results.
+        measured is {(dirpath, filename): (profile_key, log_files, reuse)}
+        for executables which are already measured, if it is given, other
+        executables are skipped."""
+        # Documents are written by ingest queue in background, so database
+        # doesn't slow down profiling of next tests.
+        self._writer = data.BulkWriter(batch_size=self.opts.bulk_size,
+                                       max_bytes=self.opts.bulk_bytes,
+                                       queue=self._ingest)
+        run = data.Run(date_time=self.ts, options=options, ingesting=True)
+        self._writer.add(run)
+        self._runs.append(run)
+        # Profiles of run, (dirpath, filename, log_files).
+        self._run_profiles = []
+
+        # Profiled runs are executed one by one to keep measurements clean,
+        # post-processing of finished runs is done by pool of workers.
+        pool = self._pool
+        # Run is new, so it has no saved functions yet.
+        self._functions = data.FunctionCache(run.meta.id, self._writer,
+                                             load_existing=False)
+        self._columnar = None
+        if self.opts.columnar_store:
+            self._columnar = columnar.ColumnarWriter(
+                self.opts.columnar_store, run.meta.id, options=options,
+                date_time=self.ts)
+        pending = []
+        for dirpath, filename, run_line in self._collect_tests(path):
+            if measured is not None:
+                if (dirpath, filename) not in measured:
+                    continue
+                profile_key, log_files, reuse = measured[(dirpath, filename)]
+            else:
+                profile_key, log_files = self._prepare_test(dirpath, filename,
+                                                            run_line)
+                reuse = log_files is not None
+                if not reuse:
+                    log_files = self._profile_test(dirpath, filename, run_line)
+                    if not log_files:
+                        continue
+            if reuse:
+                note("Reusing profile of %s" % filename)
+            self._run_profiles.append((dirpath, filename, log_files))
+            job = (dirpath, filename, run_line, log_files, profile_key, reuse)
+            if pool:
+                # Workers are forked once, so they get current profiler
+                # with each job.
+                pending.append(pool.apply_async(
+                        _process_test_job, (self.opts.profiler, self.args, job)))
+                pending = self._save_ready_results(run, pending)
+            else:
+                try:
+                    metrics_results, features_output_files = self._process_test(*job)
+                except:
+                    fatal("exception processing test: %r\n%s" % (
+                            filename, traceback.format_exc()))
+                self.save_results(run, self._parse_features_output(features_output_files),
+                                  metrics_results)
+        if pool:
+            self._save_ready_results(run, pending, wait=True)
+        # Run is saved again after its loops, so ingest time is set
+        # only for complete runs.
+        self._save_machine_state(run)
+        run.ingest_time = timestamp()
+        run.ingesting = False
+        self._writer.add(run)
+        self._writer.flush(refresh=True)
+        if self._columnar:
+            self._columnar.close()
+
+    def _save_machine_state(self, run):
+        """Save state of machine recorded during measurements of run."""
+        if not self._harness:
+            return
+        run.profile_cpus = self._harness.cpus
+        run.cpu_governors = sorted(self._harness.governors)
+        run.load_average = self._harness.max_load_average
+        run.noise = self._harness.noise + self._skipped
+        run.noisy = self._harness.noisy
+        if run.noisy:
+            warning("run %s was measured on noisy machine: %s" % (
+                    run.options, "; ".join(self._harness.noise)))
+        if self._skipped:
+            warning("%d measurements of run %s were refused on noisy machine" % (
+                    len(self._skipped), run.options))
+
+    def _save_ready_results(self, run, pending, wait=False):
+        """Save results of finished post-processing jobs.
+        Returns list of jobs which are still in progress."""
+        in_progress = []
+        for result in pending:
+            if not wait and not result.ready():
+                in_progress.append(result)
+                continue
+            try:
+                metrics_results, features_output_files = result.get()
+            except Exception as e:
+                fatal("exception processing test:\n%s" % e)
+            self.save_results(run, self._parse_features_output(features_output_files),
+                              metrics_results)
+        return in_progress
+
+    def _process_test(self, dirpath, filename, run_line, log_files,
+                      profile_key=None, reuse=False):
+        """Post-process profiled executable, log_files are logs of its
+        repetitions. Saved profile is parsed again if reuse is set,
+        otherwise profile is stamped with profile_key after analysis.
+        Features are parsed while they are saved.
+        Returns (metrics_results, features_output_files)."""
+        # Parse bindings.
+        bindings_file = os.path.join(dirpath, filename + ".bindings")
+        bind_filenames = self._get_bindings(bindings_file)
+        offset_files = []
+        features_output_files = []
+
+        for bind_file in bind_filenames:
+            offset_file = os.path.join(dirpath, bind_file + ".functions.offset")
+            features_output_file = os.path.join(dirpath, bind_file + ".features.output")
+            if os.path.isfile(offset_file):
+                offset_files.append(offset_file)
+            if os.path.isfile(features_output_file):
+                features_output_files.append(features_output_file)
+        #code_size_results = LoopCodeSizeCounter().run(offset_files, filename)
+        #print(code_size_results)
+        repetitions = []
+        for log_file in log_files:
+            if reuse:
+                repetitions.append(self._parse_profile(log_file, run_line, filename,
+                                                       offset_files))
+            else:
+                repetitions.append(self._analyze(log_file, run_line, filename,
+                                                 offset_files))
+        if profile_key and not reuse:
+            with open(self._get_profile_stamp(dirpath, filename), 'w') as stamp:
+                stamp.write("%s\n%d\n" % (profile_key, len(log_files)))
+        metrics_results = self._merge_repetitions(repetitions)
+        #print(metrics_results)
+        return (metrics_results, features_output_files)
+
+    def _merge_repetitions(self, repetitions):
+        """Merge metrics of loops from several measurements.
+        Returns {full_id: (function_name, exec_times, code_size, llc_misses)},
+        where exec_times and llc_misses are lists of measured values."""
+        results = {}
+        for metrics_results in repetitions:
+            for full_id, value in metrics_results.iteritems():
+                if full_id not in results:
+                    results[full_id] = (value[0], [], value[2], [])
+                results[full_id][1].append(value[1])
+                results[full_id][3].append(value[3])
+        return results
 
     def _parse_features_output(self, output_files):
-        result = []
-        cur_json_string = ""
+        """Parse features printed by compiler, each JSON object ends with
+        line starting with '}'. Yields parsed objects one by one."""
+        cur_json_parts = []
         for output_filename in output_files:
             with open(output_filename) as output:
-                for line in output.readlines():
-                    cur_json_string = cur_json_string + line.rstrip()
+                for line in output:
+                    cur_json_parts.append(line.rstrip())
                     if line.startswith("}"):
-                        result.append(cur_json_string)
-                        cur_json_string = ""
-        return result
+                        yield json.loads(''.join(cur_json_parts))
+                        cur_json_parts = []
 
     def save_results(self, run, features, metrics_results):
-        typed_features = {}
-        # Save static features.
-        order = 0
-        for features_set in features:
-            features_instance, typed_instance = data.FeaturesFactory.createFeatures(features_set, order)
-            features_instance.save()
-            typed_instance.features_id = features_instance.meta.id
-            if not typed_instance.block_id in typed_features:
-                typed_features[typed_instance.block_id] = []
-            typed_features[typed_instance.block_id].append(typed_instance)
-            order += 1
+        """Save loops and their features. Features are parsed descriptions,
+        which are saved as soon as they are read."""
+        # Loops are added first, so that loop ids are known for features.
+        loop_ids = {}
+        loops = []
         for key, value in metrics_results.iteritems():
             keys_parts = key.split('.')
 
-            function = data.Function.get_ot_create_function(application = keys_parts.pop(0),
-                                                   run_id = run.meta.id, 
-                                                   filename = keys_parts.pop(0), 
-                                                   function_name = value[0])
+            application = keys_parts.pop(0)
+            filename = keys_parts.pop(0)
+            function_id = self._functions.get_function_id(application = application,
+                                                          filename = filename,
+                                                          function_name = value[0])
             block_id = '.'.join(keys_parts)
             block = data.Loop(loop_id = block_id, 
-                              exec_time = value[1],
                               code_size = value[2],
-                              llc_misses = value[3],
-                              function_id = function.meta.id)
+                              function_id = function_id,
+                              repetitions = len(value[1]))
+            for metric, values in (('exec_time', value[1]), ('llc_misses', value[3])):
+                summary = stats.summarize(values)
+                setattr(block, metric, int(round(summary['median'])))
+                for name, statistic in summary.iteritems():
+                    setattr(block, metric + '_' + name, statistic)
             #print("%s, %s, %s" % (key, value[1], value[2]))
-            block.save()
-            if block_id in typed_features:
-                for cur_feature in typed_features[block_id]:
-                    cur_feature.block_id = block.meta.id
-                    cur_feature.save()
-
-    def _profile(self, log_file, run_line, application, offset_files):
-        locals = globals = {}
-        base_profiler_modules_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                                                 '../profilers')
-        module_path = os.path.join(base_profiler_modules_path, 
-                                   self.opts.profiler, 
-                                   'profiler.py')
-        module_file = open(module_path)
+            loop_id = self._writer.add(block)
+            loop_ids.setdefault(block_id, []).append(loop_id)
+            if self._columnar:
+                self._columnar.add_loop(block, application, filename, value[0])
+            if self.opts.denormalize:
+                loops.append((block, application, filename, value[0]))
+        # Save static features.
+        loops_features = {}
+        for order, features_set in enumerate(features):
+            features_instance, typed_instance = data.FeaturesFactory.createFeatures(features_set, order)
+            typed_instance.features_id = self._writer.add(features_instance)
+            for loop_id in loop_ids.get(typed_instance.block_id, []):
+                typed_instance.block_id = loop_id
+                self._writer.add(typed_instance)
+                if self._columnar:
+                    self._columnar.add_features(loop_id, order, features_instance)
+                if self.opts.denormalize:
+                    loops_features.setdefault(loop_id, []).append((order, features_instance))
+        for block, application, filename, function_name in loops:
+            self._writer.add(data.RunLoop.from_loop(
+                block, run.meta.id, run.options, application, filename,
+                function_name, loops_features.get(block.meta.id, [])))
+
+    def _load_profiler(self):
+        """Get profiler instance, it is created once for each profiler and
+        reused for all executables."""
+        if self.opts.profiler in self._profiler_instances:
+            return self._profiler_instances[self.opts.profiler]
         try:
-            exec module_file in locals, globals
+            profiler_class = profilers.get_profiler_class(self.opts.profiler)
         except:
             info = traceback.format_exc()
-            fatal("unable to import test module: %r\n%s" % (
-                    module_path, info))
-
-        profiler_class = globals.get('profiler_class')
-        if profiler_class is None:
-            fatal("no 'profiler_class' global in import profiler module: %r" % (
-                    module_path,))
+            fatal("unable to import profiler module: %r\n%s" % (
+                    self.opts.profiler, info))
         try:
             profiler_instance = profiler_class()
         except:
             info = traceback.format_exc()
             fatal("unable to instantiate profiler class for: %r\n%s" % (
-                    module_path, info))
+                    self.opts.profiler, info))
 
         if not isinstance(profiler_instance, Profiler):
             fatal("invalid test class (expected runsystem.testrunner.Profiler "
-                  "subclass) for: %r" % module_path)
+                  "subclass) for: %r" % self.opts.profiler)
+        profiler_instance.harness = self._harness
+        self._profiler_instances[self.opts.profiler] = profiler_instance
+        return profiler_instance
 
+    def _measure(self, log_file, run_line, application):
+        profiler_instance = self._load_profiler()
         try:
             print("\n")
             note("Start profiling %s\n" % application)
-            results = profiler_instance._run(log_file, run_line, self.opts.profiler_path, 
-                                    application, offset_files, self.args)
+            profiler_instance._measure(log_file, run_line, self.opts.profiler_path,
+                                       application, self.args)
+        except harness.NoisyMachineError:
+            raise
         except:
             info = traceback.format_exc()
             fatal("exception executing profiling for: %r\n%s" % (
-                    module_path, info))
+                    application, info))
 
-        return results
+    def _analyze(self, log_file, run_line, application, offset_files):
+        # Exceptions are passed to caller, because it can be executed
+        # in worker process.
+        profiler_instance = self._load_profiler()
+        return profiler_instance._analyze(log_file, run_line, self.opts.profiler_path,
+                                          application, offset_files, self.args)
+
+    def _parse_profile(self, log_file, run_line, application, offset_files):
+        profiler_instance = self._load_profiler()
+        return profiler_instance._parse(log_file, run_line, self.opts.profiler_path,
+                                        application, offset_files, self.args)
+
+# File with description of configuration run in sandbox.
+MANIFEST_NAME = "runsystem.manifest.json"
+
+# Directory in configuration directory with copy of profiles made in shared
+# build directory of build cache.
+PROFILES_DIR = "profiles"
+
+# Separator of compiler flags and options of run in CMAKE_C_FLAGS.
+FEATURES_FLAGS = " -mllvm -print-features-before-all"
+
+# Fields of Run with state of machine during measurements.
+MACHINE_STATE_FIELDS = ('profile_cpus', 'cpu_governors', 'load_average',
+                        'noise', 'noisy')
+
+# Minimal number of measurements for early stopping.
+MIN_REPEAT = 3
+
+# Test runner used by post-processing worker processes.
+_worker_runner = None
+
+def _init_worker(runner):
+    global _worker_runner
+    _worker_runner = runner
+
+def _process_test_job(profiler, args, job):
+    _worker_runner.opts.profiler = profiler
+    _worker_runner.args = args
+    try:
+        return _worker_runner._process_test(*job)
+    except:
+        # Traceback can't be passed to main process, so pass it as message.
+        raise RuntimeError(traceback.format_exc())
 
 def create_instance():
     return TestRunner()
@@ -9,6 +9,10 @@ import contextlib
 import runsystem.util.multitool
 from runsystem.testrunner.testrunner import TestRunner, LOGGER_NAME
 from runsystem.db.reportgenerator import ExcelReportGenerator
+import runsystem.db.data
+import runsystem.db.ingest
+import runsystem.db.columnar
+import runsystem.db.dataset
 
 def action_runserver(name, args):
     """start a new development server"""
@@ -77,6 +81,17 @@ def action_runtest(name, args):
 
     print args
 
+    _setup_test_logger()
+    runner = TestRunner()
+    runner.run_test('%s' % (name), args)
+
+def action_replay(name, args):
+    """parse stored profiles of sandbox again and save them as new runs"""
+    _setup_test_logger()
+    runner = TestRunner()
+    runner.replay_test('%s' % (name), args)
+
+def _setup_test_logger():
     logger = logging.getLogger(LOGGER_NAME)
     logger.setLevel(logging.INFO)
     handler = logging.StreamHandler()
@@ -85,18 +100,140 @@ def action_runtest(name, args):
             '%(asctime)s %(levelname)s: %(message)s',
             datefmt='%Y-%m-%d %H:%M:%S'))
     logger.addHandler(handler)
-    runner = TestRunner()
-    runner.run_test('%s' % (name), args)
 
 def action_get_excel_report(name, args):
     parser = OptionParser("%s [options]" % name)
     parser.add_option("-o", "--output", dest="output", type=str, default=None)
+    parser.add_option("", "--run-id", dest="run_id", type=str, default=None,
+                      help="export only loops of given run")
+    parser.add_option("", "--application", dest="application", type=str,
+                      default=None, help="export only loops of given application")
+    parser.add_option("", "--streaming", dest="streaming", default=False,
+                      action="store_true",
+                      help="export all loops with constant memory usage")
     (opts, args) = parser.parse_args(args)
     if len(args) != 0:
         parser.error("invalid number of arguments")
     if not opts.output:
         parser.error("output file is nessecary")
-    ExcelReportGenerator().get_report(opts.output)
+    ExcelReportGenerator().get_report(opts.output, run_id=opts.run_id,
+                                      application=opts.application,
+                                      streaming=opts.streaming)
+
+def action_export_dataset(name, args):
+    """export features and metric changes of connected runs for ML"""
+    parser = OptionParser("%s [options]" % name)
+    parser.add_option("-o", "--output", dest="output", type=str, default=None,
+                      help="output file, .npz or .csv")
+    parser.add_option("", "--format", dest="format", type="choice",
+                      choices=["npz", "csv"], default=None,
+                      help="output format (by output file extension by "
+                           "default)")
+    parser.add_option("", "--run-id", dest="run_ids", action="append",
+                      default=[], metavar="ID",
+                      help="export given run compared with its connected "
+                           "run (all connected runs by default)")
+    parser.add_option("", "--columnar-store", dest="columnar_store", type=str,
+                      default=None, metavar="PATH",
+                      help="read runs from columnar store instead of "
+                           "database")
+    parser.add_option("", "--features-place", dest="place", type=str,
+                      default="Before",
+                      help="place of features set of loop [%default]")
+    parser.add_option("", "--pass-name", dest="pass_name", type=str,
+                      default=None,
+                      help="use features set collected around given pass")
+    parser.add_option("", "--batch-size", dest="batch_size", type=int,
+                      default=500, metavar="N",
+                      help="number of documents read together [%default]")
+    (opts, args) = parser.parse_args(args)
+    if len(args) != 0:
+        parser.error("invalid number of arguments")
+    if not opts.output:
+        parser.error("output file is nessecary")
+    output_format = opts.format or os.path.splitext(opts.output)[1][1:]
+    if output_format not in ("npz", "csv"):
+        parser.error("unknown output format, use --format")
+    if not runsystem.db.columnar.available():
+        parser.error("numpy is required for dataset export")
+    if not opts.columnar_store:
+        runsystem.db.data.init_database()
+    dataset = runsystem.db.dataset.build_dataset(
+        opts.run_ids, opts.columnar_store, opts.place, opts.pass_name,
+        opts.batch_size)
+    if dataset is None:
+        parser.error("no connected runs found")
+    if output_format == "npz":
+        runsystem.db.dataset.write_npz(opts.output, dataset)
+    else:
+        runsystem.db.dataset.write_csv(opts.output, dataset)
+    print "%d loops exported" % len(dataset['features'])
+
+def action_initdb(name, args):
+    """create database mappings"""
+    parser = OptionParser("%s [options]" % name)
+    (opts, args) = parser.parse_args(args)
+    if len(args) != 0:
+        parser.error("invalid number of arguments")
+    runsystem.db.data.init_database(force=True)
+
+def action_backfill_loops(name, args):
+    """save denormalized loops for existing runs"""
+    parser = OptionParser("%s [options]" % name)
+    parser.add_option("", "--run-id", dest="run_id", type=str, default=None,
+                      help="process only given run")
+    (opts, args) = parser.parse_args(args)
+    if len(args) != 0:
+        parser.error("invalid number of arguments")
+    runsystem.db.data.init_database()
+    runsystem.db.data.backfill_run_loops(runsystem.db.data.BulkWriter(),
+                                         run_id=opts.run_id)
+
+def action_ingest_journal(name, args):
+    """write documents spooled to ingest journal to database"""
+    parser = OptionParser("%s [options] journal" % name)
+    parser.add_option("", "--bulk-size", dest="bulk_size", type=int,
+                      default=500, metavar="N",
+                      help="Number of documents in one database bulk "
+                           "request [%default]")
+    (opts, args) = parser.parse_args(args)
+    if len(args) != 1:
+        parser.error("invalid number of arguments")
+    journal, = args
+    # Interrupted replay left renamed journal.
+    if not os.path.exists(journal) and \
+            not os.path.exists(journal + '.replaying'):
+        parser.error("journal not found: %r" % journal)
+    runsystem.db.data.init_database()
+    written = runsystem.db.ingest.replay_journal(journal, opts.bulk_size)
+    print "%d documents written" % written
+
+def action_compute_loop_deltas(name, args):
+    """match loops of connected runs and save their deltas"""
+    parser = OptionParser("%s [options]" % name)
+    parser.add_option("", "--run-id", dest="run_id", type=str, default=None,
+                      help="process only given run")
+    parser.add_option("", "--compared-run-id", dest="compared_run_id",
+                      type=str, default=None,
+                      help="compare run with given run instead of its "
+                           "connected run")
+    parser.add_option("", "--batch-size", dest="batch_size", type=int,
+                      default=500, metavar="N",
+                      help="number of documents read together [%default]")
+    (opts, args) = parser.parse_args(args)
+    if len(args) != 0:
+        parser.error("invalid number of arguments")
+    if opts.compared_run_id and not opts.run_id:
+        parser.error("--compared-run-id requires --run-id")
+    runsystem.db.data.init_database()
+    writer = runsystem.db.data.BulkWriter()
+    if opts.compared_run_id:
+        matched = runsystem.db.data.compute_loop_deltas(
+            writer, opts.run_id, opts.compared_run_id, opts.batch_size)
+        print "%d loops matched" % matched
+    else:
+        runsystem.db.data.compute_connected_loop_deltas(
+            writer, run_id=opts.run_id, batch_size=opts.batch_size)
 
 tool = runsystem.util.multitool.MultiTool(locals())
 
@@ -55,4 +55,6 @@ TODO
             ],
         },
     install_requires=reqs,
+    # Optional columnar store of results (runsystem.db.columnar).
+    extras_require={'columnar': ['numpy']},
 )
\ No newline at end of file